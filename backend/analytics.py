@@ -0,0 +1,238 @@
+"""
+Signup analytics served from pre-aggregated hourly rollups
+
+subscriber_rollups holds one row per (hour, source) with the number of
+signups and unsubscribes. A background task refreshes it incrementally: only
+the hours from the latest stored bucket (minus REFRESH_OVERLAP, for late
+commits) onwards are recomputed from subscribers and suppressions, so a
+refresh costs an index range scan over the last hour or two however long the
+history is. The first refresh backfills everything.
+
+Unsubscribes are attributed to the source of the matching subscriber row, or
+"unknown" for suppressed addresses that never subscribed. Dashboard queries
+(GET /api/admin/analytics) read at most a few rows per hour and source.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select, delete, func, literal_column, text
+
+from config import settings
+from database import SessionLocal, Subscriber, Suppression, SubscriberRollup
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("hour", "day")
+REFRESH_OVERLAP = timedelta(hours=1)
+UNKNOWN_SOURCE = "unknown"
+MAX_HOURLY_RANGE = timedelta(days=31)
+_ADVISORY_LOCK_KEY = 0x6E666C77  # one refresh at a time across workers (PostgreSQL)
+
+_SQLITE_FORMATS = {"hour": "'%Y-%m-%d %H:00:00'", "day": "'%Y-%m-%d 00:00:00'"}
+
+def _truncate(dialect_name: str, column, unit: str = "hour"):
+    """Truncate a timestamp column to the start of its hour or day"""
+    if dialect_name == "postgresql":
+        return func.date_trunc(literal_column(f"'{unit}'"), column)
+    return func.strftime(literal_column(_SQLITE_FORMATS[unit]), column)
+
+def _to_bucket(value) -> datetime:
+    """Naive UTC datetime from a driver value (SQLite returns strings, timestamptz is aware)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class SignupAnalytics:
+    """Incremental refresh of subscriber_rollups and the queries behind the analytics endpoint"""
+
+    def __init__(self):
+        self.enabled = settings.ANALYTICS_ENABLED
+        self.refreshed_at: Optional[float] = None
+        self.refresh_duration: Optional[float] = None
+        self.refreshed_buckets = 0
+        self.skipped = 0
+
+    def refresh(self, full: bool = False) -> bool:
+        """
+        Recompute the rollup rows from the last stored hour onwards
+
+        Args:
+            full: Rebuild every bucket instead of the recent ones
+
+        Returns:
+            False if another worker was already refreshing
+        """
+        started = time.time()
+        db = SessionLocal()
+        try:
+            dialect_name = db.get_bind().dialect.name
+            if dialect_name == "postgresql":
+                locked = db.execute(
+                    text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _ADVISORY_LOCK_KEY}
+                ).scalar()
+                if not locked:
+                    self.skipped += 1
+                    return False
+
+            since = None
+            if not full:
+                latest = db.execute(select(func.max(SubscriberRollup.bucket))).scalar()
+                if latest is not None:
+                    since = _to_bucket(latest) - REFRESH_OVERLAP
+
+            counts: Dict[Tuple[datetime, str], list] = {}
+
+            bucket = _truncate(dialect_name, Subscriber.created_at)
+            source = func.coalesce(Subscriber.source, "website")
+            query = select(bucket, source, func.count()).group_by(bucket, source)
+            if since is not None:
+                query = query.where(Subscriber.created_at >= since)
+            for row_bucket, row_source, signups in db.execute(query):
+                counts.setdefault((_to_bucket(row_bucket), row_source), [0, 0])[0] += signups
+
+            bucket = _truncate(dialect_name, Suppression.unsubscribed_at)
+            source = func.coalesce(Subscriber.source, UNKNOWN_SOURCE)
+            query = (
+                select(bucket, source, func.count())
+                .select_from(Suppression)
+                .outerjoin(Subscriber, Subscriber.email == Suppression.email)
+                .group_by(bucket, source)
+            )
+            if since is not None:
+                query = query.where(Suppression.unsubscribed_at >= since)
+            for row_bucket, row_source, unsubscribes in db.execute(query):
+                counts.setdefault((_to_bucket(row_bucket), row_source), [0, 0])[1] += unsubscribes
+
+            stale = delete(SubscriberRollup)
+            if since is not None:
+                stale = stale.where(SubscriberRollup.bucket >= since)
+            db.execute(stale)
+            if counts:
+                db.execute(
+                    SubscriberRollup.__table__.insert(),
+                    [
+                        {"bucket": key[0], "source": key[1], "signups": value[0], "unsubscribes": value[1]}
+                        for key, value in counts.items()
+                    ]
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        self.refreshed_at = time.time()
+        self.refresh_duration = self.refreshed_at - started
+        self.refreshed_buckets = len(counts)
+        logger.info(
+            "Analytics rollups refreshed in %.2fms: %d buckets since %s",
+            self.refresh_duration * 1000, len(counts), since or "the beginning"
+        )
+        return True
+
+    async def refresh_async(self, full: bool = False) -> bool:
+        """Refresh in a worker thread so the event loop keeps serving requests"""
+        return await asyncio.to_thread(self.refresh, full)
+
+    async def run_periodic_refresh(self):
+        """Background task: refresh at startup, then every refresh interval"""
+        interval = settings.ANALYTICS_REFRESH_INTERVAL
+        while True:
+            try:
+                await self.refresh_async()
+            except Exception as e:
+                logger.error("Analytics rollup refresh failed: %s", e)
+            if interval <= 0:
+                return
+            await asyncio.sleep(interval)
+
+    def query(
+        self,
+        granularity: str,
+        since: datetime,
+        until: datetime,
+        source: Optional[str] = None
+    ) -> Dict:
+        """
+        Signups and unsubscribes per bucket between since and until
+
+        Args:
+            granularity: "hour" or "day" (days are summed from the hourly rows in SQL)
+            since: Start of the range (naive UTC, inclusive)
+            until: End of the range (naive UTC, exclusive)
+            source: Only this signup source
+
+        Returns:
+            Series of non-empty buckets, per-source and overall totals
+        """
+        db = SessionLocal()
+        try:
+            bucket = SubscriberRollup.bucket
+            if granularity == "day":
+                bucket = _truncate(db.get_bind().dialect.name, bucket, "day")
+            query = (
+                select(
+                    bucket, SubscriberRollup.source,
+                    func.sum(SubscriberRollup.signups), func.sum(SubscriberRollup.unsubscribes)
+                )
+                .where(SubscriberRollup.bucket >= since, SubscriberRollup.bucket < until)
+                .group_by(bucket, SubscriberRollup.source)
+            )
+            if source:
+                query = query.where(SubscriberRollup.source == source)
+            rows = db.execute(query).all()
+        finally:
+            db.close()
+
+        series: Dict[datetime, list] = {}
+        by_source: Dict[str, list] = {}
+        for row_bucket, row_source, signups, unsubscribes in rows:
+            entry = series.setdefault(_to_bucket(row_bucket), [0, 0])
+            entry[0] += signups
+            entry[1] += unsubscribes
+            entry = by_source.setdefault(row_source, [0, 0])
+            entry[0] += signups
+            entry[1] += unsubscribes
+
+        signups = sum(entry[0] for entry in by_source.values())
+        unsubscribes = sum(entry[1] for entry in by_source.values())
+        return {
+            "granularity": granularity,
+            "since": since.isoformat(),
+            "until": until.isoformat(),
+            "source": source,
+            "series": [
+                {"bucket": key.isoformat(), "signups": value[0], "unsubscribes": value[1]}
+                for key, value in sorted(series.items())
+            ],
+            "by_source": {
+                key: {"signups": value[0], "unsubscribes": value[1]}
+                for key, value in sorted(by_source.items())
+            },
+            "totals": {
+                "signups": signups,
+                "unsubscribes": unsubscribes,
+                "unsubscribe_rate": round(unsubscribes / signups, 4) if signups else None,
+            },
+            "refreshed_at": (
+                datetime.utcfromtimestamp(self.refreshed_at).isoformat() if self.refreshed_at else None
+            ),
+        }
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "refreshed_at": self.refreshed_at,
+            "refresh_duration_ms": round(self.refresh_duration * 1000, 2) if self.refresh_duration else None,
+            "refreshed_buckets": self.refreshed_buckets,
+            "skipped": self.skipped,
+        }
+
+# Global analytics instance
+signup_analytics = SignupAnalytics()
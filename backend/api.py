@@ -1,46 +1,84 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, File, HTTPException, status, Request, UploadFile
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
+import asyncio
+import io
+from datetime import datetime, timedelta, timezone
 import logging
 import re
 import time
 import uuid
+from typing import NamedTuple, Optional
 
-from database import get_db
-from schemas import SubscriberCreate, SubscribeResponse, ErrorResponse, UnsubscribeRequest, UnsubscribeResponse
-from services import SubscriberService
-from security import get_client_ip, validate_request_headers
+from database import get_session, pool_stats
+from schemas import (
+    SubscriberCreate, SubscribeResponse, ErrorResponse, UnsubscribeRequest, UnsubscribeResponse, ConfirmResponse
+)
+from services import SubscriberService, AsyncSubscriberService
+from membership import membership_filter
+from security import get_client_ip, validate_request_headers, rate_limiter
 from config import settings
+from metrics import subscribe_stage_duration
+from email_validation import is_valid_email
+from blocklist import disposable_domains
+from write_behind import write_behind
+from counting import COUNT_MODES, subscriber_counter
+from export import iter_export, MEDIA_TYPES as EXPORT_MEDIA_TYPES
+from analytics import GRANULARITIES, MAX_HOURLY_RANGE, signup_analytics
+from responses import PrecomputedJSON
+from coalescing import subscribe_coalescer
+from confirmation import verify_confirmation_token
+from outbox import outbox_dispatcher
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Enhanced email validation
-EMAIL_REGEX = re.compile(
-    r'^[a-zA-Z0-9.!#$%&\'*+/=?^_`{|}~-]+@[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?(?:\.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*$'
+SUBSCRIBE_SUCCESS_MESSAGE = "Inscription réussie ! Vérifiez votre email pour commencer votre essai gratuit de 14 jours."
+
+# Write-behind acknowledgement, identical for every request
+SUBSCRIBE_QUEUED_RESPONSE = PrecomputedJSON(
+    {"message": SUBSCRIBE_SUCCESS_MESSAGE, "subscriber": None},
+    status_code=status.HTTP_202_ACCEPTED
 )
 
+# Idempotency-Key header: opaque client token (a UUID in practice)
+IDEMPOTENCY_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,255}$")
+
+class SignupOutcome(NamedTuple):
+    """Result of storing a signup, shared by coalesced duplicate requests"""
+    email: str
+    subscriber: Optional[dict]  # id, email, created_at; None when queued (write-behind)
+    created: bool
+
+def _subscribe_response(subscriber: dict) -> ORJSONResponse:
+    """SubscribeResponse body for a stored subscriber, encoded directly by orjson (UUID and datetime included)"""
+    return ORJSONResponse(
+        {"message": SUBSCRIBE_SUCCESS_MESSAGE, "subscriber": subscriber},
+        status_code=status.HTTP_201_CREATED
+    )
+
 def validate_email_format(email: str) -> bool:
-    """Enhanced email validation with security checks"""
-    if len(email) > 254:  # RFC 5321 limit
-        return False
-    if not EMAIL_REGEX.match(email):
-        return False
-    
-    # Additional security checks
-    suspicious_patterns = [
-        r'\.{2,}',      # Multiple consecutive dots
-        r'^\.|\.$',     # Starting or ending with dot
-        r'@.*@',        # Multiple @ symbols
-        r'[<>]',        # HTML injection attempts
-        r'[\'";]',      # SQL injection attempts
-    ]
-    
-    for pattern in suspicious_patterns:
-        if re.search(pattern, email):
-            return False
-    return True
+    """Enhanced email validation with security checks (shared rule set, see email_validation)"""
+    return is_valid_email(email, check_domain=False)
+
+async def _service_call(method: str, *args, **kwargs):
+    """Dispatch to the sync or async subscriber service depending on DATABASE_ASYNC"""
+    if settings.DATABASE_ASYNC:
+        return await getattr(AsyncSubscriberService, method)(*args, **kwargs)
+    return getattr(SubscriberService, method)(*args, **kwargs)
+
+def verify_admin_key(request: Request, admin_key: str = None):
+    """Simple admin authentication for production (raises 401 on mismatch)"""
+    if settings.is_production:
+        expected_key = settings.SECRET_KEY[:16]  # Use part of secret key
+        if not admin_key or admin_key != expected_key:
+            logger.warning("Unauthorized access attempt to admin endpoint from %s", get_client_ip(request))
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Unauthorized"
+            )
 
 def generate_request_id() -> str:
     """Generate unique request ID for tracking"""
@@ -51,6 +89,7 @@ def generate_request_id() -> str:
     response_model=SubscribeResponse,
     status_code=status.HTTP_201_CREATED,
     responses={
+        202: {"model": SubscribeResponse, "description": "Inscription enregistrée (écriture différée)"},
         400: {"model": ErrorResponse, "description": "Requête invalide"},
         422: {"model": ErrorResponse, "description": "Données invalides"},
         429: {"model": ErrorResponse, "description": "Trop de tentatives"},
@@ -60,7 +99,7 @@ def generate_request_id() -> str:
 async def subscribe(
     subscriber_data: SubscriberCreate,
     request: Request,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ):
     """
     Subscribe a new email to the newsletter
@@ -80,117 +119,204 @@ async def subscribe(
     request.state.request_id = request_id
     
     try:
-        # Log all request details for debugging
-        logger.info(f"[{request_id}] Subscribe request from {client_ip}")
-        logger.info(f"[{request_id}] Headers: {dict(request.headers)}")
-        logger.info(f"[{request_id}] Email: {subscriber_data.email}")
-        logger.info(f"[{request_id}] Method: {request.method}, Path: {request.url.path}")
+        logger.info("[%s] Subscribe request from %s", request_id, client_ip)
+        logger.debug("[%s] Email: %s", request_id, subscriber_data.email)
+        if settings.LOG_HEADERS:
+            # Header dumps are opt-in: building the dict costs even when the record is dropped
+            logger.debug("[%s] %s %s headers: %s", request_id, request.method, request.url.path, dict(request.headers))
         
         # Validate request headers and format
-        if not validate_request_headers(request):
-            logger.warning(f"[{request_id}] Invalid headers from {client_ip}")
+        with subscribe_stage_duration.time("header_validation"):
+            headers_valid = validate_request_headers(request, client_ip)
+        if not headers_valid:
+            logger.warning("[%s] Invalid headers from %s", request_id, client_ip)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Requête invalide." if settings.is_production else "En-têtes de requête invalides."
             )
         
-        # Enhanced email validation
-        if not validate_email_format(subscriber_data.email):
-            logger.warning(f"[{request_id}] Invalid email format from {client_ip}: {subscriber_data.email}")
+        # Email format and domain were validated once by SubscriberCreate
+        # (timed there as the "email_validation" stage)
+        
+        idempotency_key = request.headers.get("idempotency-key")
+        if idempotency_key is not None and not IDEMPOTENCY_KEY_PATTERN.match(idempotency_key):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Format d'email invalide."
+                detail="En-tête Idempotency-Key invalide."
             )
         
-        # Check for existing subscriber
-        existing_subscriber = SubscriberService.get_subscriber_by_email(
-            db=db, 
-            email=subscriber_data.email
-        )
+        async def store() -> SignupOutcome:
+            # Write-behind mode: acknowledge now, the row is inserted with the next batch.
+            # A full queue falls through to the direct write below.
+            if write_behind.enabled and write_behind.submit(subscriber_data.email, subscriber_data.source):
+                return SignupOutcome(subscriber_data.email, None, True)
+            
+            # Insert or fetch the subscriber in a single round trip: the duplicate
+            # lookup and the insert are one statement, timed as one stage
+            with subscribe_stage_duration.time("db_upsert"):
+                subscriber, created = await _service_call(
+                    "upsert_subscriber",
+                    db=db,
+                    subscriber_data=subscriber_data
+                )
+            if settings.DOUBLE_OPT_IN_ENABLED and (created or subscriber.confirmed_at is None):
+                outbox_dispatcher.notify()  # confirmation email committed with the subscriber (or resent)
+            return SignupOutcome(
+                subscriber_data.email,
+                {"id": subscriber.id, "email": subscriber.email, "created_at": subscriber.created_at},
+                created
+            )
         
-        if existing_subscriber:
-            logger.info(f"[{request_id}] Duplicate subscription from {client_ip}: {subscriber_data.email}")
+        # Duplicate submissions (double clicks, client retries) in flight at the
+        # same time share one store(); repeats within COALESCE_TTL get its result
+        key = f"idempotency:{idempotency_key}" if idempotency_key else f"email:{subscriber_data.email}"
+        outcome, shared = await subscribe_coalescer.run(key, store)
+        
+        if outcome.email != subscriber_data.email:
+            logger.warning("[%s] Idempotency-Key reused for another email from %s", request_id, client_ip)
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Cette clé d'idempotence a déjà été utilisée pour une autre adresse email."
+            )
+        
+        if shared and not idempotency_key:
+            # Only a retry with the same Idempotency-Key replays the original
+            # response; other duplicates are answered as duplicates
+            outcome = outcome._replace(created=False)
+        
+        if outcome.subscriber is None:
+            logger.info("[%s] Subscription queued from %s: %s", request_id, client_ip, subscriber_data.email)
+            return SUBSCRIBE_QUEUED_RESPONSE()
+        
+        if not outcome.created:
+            logger.info("[%s] Duplicate subscription from %s: %s", request_id, client_ip, subscriber_data.email)
             # Return same success message to prevent email enumeration
             if settings.is_production:
-                return SubscribeResponse(
-                    message="Inscription réussie ! Vérifiez votre email pour commencer votre essai gratuit de 14 jours.",
-                    subscriber=existing_subscriber
-                )
+                return _subscribe_response(outcome.subscriber)
             else:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Cette adresse email est déjà inscrite à notre liste."
                 )
         
-        # Create new subscriber
-        new_subscriber = SubscriberService.create_subscriber(
-            db=db, 
-            subscriber_data=subscriber_data
-        )
-        
         processing_time = round((time.time() - start_time) * 1000, 2)
-        logger.info(f"[{request_id}] New subscription from {client_ip}: {subscriber_data.email} ({processing_time}ms)")
+        logger.info("[%s] New subscription from %s: %s (%sms)", request_id, client_ip, subscriber_data.email, processing_time)
         
-        return SubscribeResponse(
-            message="Inscription réussie ! Vérifiez votre email pour commencer votre essai gratuit de 14 jours.",
-            subscriber=new_subscriber
-        )
+        return _subscribe_response(outcome.subscriber)
         
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
     except IntegrityError as e:
-        # Database constraint violation
-        logger.error(f"[{request_id}] Database error from {client_ip}: {str(e)}")
-        if settings.is_production:
-            # Return generic message in production
-            return SubscribeResponse(
-                message="Inscription réussie ! Vérifiez votre email pour commencer votre essai gratuit de 14 jours.",
-                subscriber=None
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Cette adresse email est déjà inscrite à notre liste."
-            )
+        # Constraint violation other than the duplicate email (handled by the upsert),
+        # e.g. the email format CHECK of schema.sql: the input is at fault
+        logger.warning("[%s] Database constraint violation from %s: %s", request_id, client_ip, e.orig)
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Format d'email invalide."
+        )
     except Exception as e:
         # Unexpected errors
         processing_time = round((time.time() - start_time) * 1000, 2)
-        logger.error(f"[{request_id}] Unexpected error from {client_ip} ({processing_time}ms): {str(e)}")
+        logger.error("[%s] Unexpected error from %s (%sms): %s", request_id, client_ip, processing_time, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Une erreur interne s'est produite. Veuillez réessayer plus tard."
         )
 
+@router.get(
+    "/confirm",
+    response_model=ConfirmResponse,
+    responses={
+        400: {"model": ErrorResponse, "description": "Lien invalide ou expiré"},
+        429: {"model": ErrorResponse, "description": "Trop de tentatives"},
+        500: {"model": ErrorResponse, "description": "Erreur serveur"},
+    }
+)
+async def confirm_subscription(
+    token: str,
+    request: Request,
+    db: Session = Depends(get_session)
+):
+    """
+    Confirm a subscription with the signed link sent by email (double opt-in)
+    
+    The token carries the email and its expiry, signed with SECRET_KEY, so
+    no lookup is needed to reject forged or expired links. Confirming twice
+    succeeds.
+    """
+    client_ip = get_client_ip(request)
+    email = verify_confirmation_token(token)
+    if email is None:
+        logger.warning("Invalid or expired confirmation token from %s", client_ip)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Lien de confirmation invalide ou expiré."
+        )
+    
+    try:
+        exists = await _service_call("confirm_subscriber", db=db, email=email)
+    except Exception as e:
+        logger.error("Error confirming %s from %s: %s", email, client_ip, e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Une erreur interne s'est produite. Veuillez réessayer plus tard."
+        )
+    
+    if not exists:
+        # Validly signed but the subscriber is gone: same answer as a bad link
+        logger.warning("Confirmation for unknown subscriber %s from %s", email, client_ip)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Lien de confirmation invalide ou expiré."
+        )
+    
+    logger.info("Subscription confirmed from %s: %s", client_ip, email)
+    return {"message": "Votre inscription est confirmée. Bienvenue chez NutriFlow !", "email": email}
+
 @router.get("/subscribers/count")
 async def get_subscriber_count(
     request: Request,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_session),
     # Add simple admin key authentication for production
-    admin_key: str = None
+    admin_key: str = None,
+    mode: str = None
 ):
     """
     Get total number of subscribers (admin endpoint)
     Requires admin authentication in production
+    
+    mode: exact, cached, incremental or estimate (see counting.py);
+    defaults to SUBSCRIBER_COUNT_DEFAULT_MODE
     """
     client_ip = get_client_ip(request)
+    verify_admin_key(request, admin_key)
     
-    # Simple admin authentication for production
-    if settings.is_production:
-        expected_key = settings.SECRET_KEY[:16]  # Use part of secret key
-        if not admin_key or admin_key != expected_key:
-            logger.warning(f"Unauthorized access attempt to admin endpoint from {client_ip}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Unauthorized"
-            )
+    mode = mode or settings.SUBSCRIBER_COUNT_DEFAULT_MODE
+    if mode not in COUNT_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Mode de comptage invalide (exact, cached, incremental ou estimate)."
+        )
     
     try:
-        count = SubscriberService.get_subscriber_count(db=db)
-        logger.info(f"Admin endpoint accessed from {client_ip}: subscriber count = {count}")
-        return {"total_subscribers": count}
+        load_exact = lambda: _service_call("get_subscriber_count", db=db)
+        count = None
+        if mode == "estimate":
+            count = await _service_call("get_estimated_subscriber_count", db=db)
+            if count is None:
+                mode = "cached"  # no planner statistics on this database
+        if mode == "exact":
+            count = await load_exact()
+        elif mode == "cached":
+            count = await subscriber_counter.cached(load_exact)
+        elif mode == "incremental":
+            count = await subscriber_counter.incremental(load_exact)
+        
+        logger.info("Admin endpoint accessed from %s: subscriber count = %s (%s)", client_ip, count, mode)
+        return {"total_subscribers": count, "mode": mode}
     except Exception as e:
-        logger.error(f"Error getting subscriber count from {client_ip}: {str(e)}")
+        logger.error("Error getting subscriber count from %s: %s", client_ip, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Une erreur interne s'est produite."
@@ -211,7 +337,7 @@ async def get_subscriber_count(
 async def unsubscribe(
     unsubscribe_data: UnsubscribeRequest,
     request: Request,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ):
     """
     Unsubscribe an email from the newsletter
@@ -230,48 +356,43 @@ async def unsubscribe(
     request.state.request_id = request_id
     
     try:
-        logger.info(f"[{request_id}] Unsubscribe request from {client_ip}")
-        logger.info(f"[{request_id}] Email: {unsubscribe_data.email}")
+        logger.info("[%s] Unsubscribe request from %s", request_id, client_ip)
+        logger.debug("[%s] Email: %s", request_id, unsubscribe_data.email)
         
         # Validate request headers
-        if not validate_request_headers(request):
-            logger.warning(f"[{request_id}] Invalid headers from {client_ip}")
+        if not validate_request_headers(request, client_ip):
+            logger.warning("[%s] Invalid headers from %s", request_id, client_ip)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Requête invalide." if settings.is_production else "En-têtes de requête invalides."
             )
         
-        # Enhanced email validation
-        if not validate_email_format(unsubscribe_data.email):
-            logger.warning(f"[{request_id}] Invalid email format from {client_ip}: {unsubscribe_data.email}")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Format d'email invalide."
-            )
+        # Email format was validated once by UnsubscribeRequest
         
         # Check if email is already unsubscribed
-        if SubscriberService.is_email_unsubscribed(unsubscribe_data.email):
-            logger.info(f"[{request_id}] Email already unsubscribed: {unsubscribe_data.email}")
+        if await _service_call("is_email_unsubscribed", db=db, email=unsubscribe_data.email):
+            logger.info("[%s] Email already unsubscribed: %s", request_id, unsubscribe_data.email)
             return UnsubscribeResponse(
                 message="Vous avez été désabonné(e) avec succès.",
                 email=unsubscribe_data.email
             )
         
         # Attempt to unsubscribe
-        success = SubscriberService.unsubscribe_email(
-            db=db, 
+        success = await _service_call(
+            "unsubscribe_email",
+            db=db,
             email=unsubscribe_data.email
         )
         
         if not success:
-            logger.warning(f"[{request_id}] Unsubscribe failed - email not found: {unsubscribe_data.email}")
+            logger.warning("[%s] Unsubscribe failed - email not found: %s", request_id, unsubscribe_data.email)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Cette adresse email n'est pas inscrite à nos communications."
             )
         
         processing_time = round((time.time() - start_time) * 1000, 2)
-        logger.info(f"[{request_id}] Successful unsubscribe from {client_ip}: {unsubscribe_data.email} ({processing_time}ms)")
+        logger.info("[%s] Successful unsubscribe from %s: %s (%sms)", request_id, client_ip, unsubscribe_data.email, processing_time)
         
         return UnsubscribeResponse(
             message="Vous avez été désabonné(e) avec succès.",
@@ -284,8 +405,236 @@ async def unsubscribe(
     except Exception as e:
         # Unexpected errors
         processing_time = round((time.time() - start_time) * 1000, 2)
-        logger.error(f"[{request_id}] Unexpected error from {client_ip} ({processing_time}ms): {str(e)}")
+        logger.error("[%s] Unexpected error from %s (%sms): %s", request_id, client_ip, processing_time, e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Une erreur interne s'est produite. Veuillez réessayer plus tard."
         )
+
+@router.get("/admin/membership-filter")
+async def get_membership_filter_stats(request: Request, admin_key: str = None):
+    """
+    Membership filter statistics: item count, memory size and false-positive rate (admin endpoint)
+    """
+    verify_admin_key(request, admin_key)
+    return membership_filter.stats()
+
+@router.post("/admin/membership-filter/rebuild")
+async def rebuild_membership_filter(request: Request, admin_key: str = None):
+    """
+    Rebuild the membership filter from the database without a restart (admin endpoint)
+    """
+    verify_admin_key(request, admin_key)
+    
+    if not membership_filter.enabled:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Membership filter disabled."
+        )
+    
+    await membership_filter.rebuild_async()
+    logger.info("Membership filter rebuilt on request from %s", get_client_ip(request))
+    return membership_filter.stats()
+
+@router.post("/admin/import")
+async def import_subscribers(
+    request: Request,
+    file: UploadFile = File(...),
+    format: str = None,
+    admin_key: str = None
+):
+    """
+    Bulk import subscribers from an uploaded CSV or NDJSON file (admin endpoint)
+    
+    Rows are validated like /subscribe and loaded in batches (COPY + merge on
+    PostgreSQL). Returns counters and the first rejected rows with their reason.
+    """
+    verify_admin_key(request, admin_key)
+    # Imported on first use: only this admin endpoint needs the loader
+    from bulk_import import detect_format, import_stream
+    
+    fmt = format or detect_format(file.filename or "")
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Format non supporté (csv ou ndjson)."
+        )
+    
+    client_ip = get_client_ip(request)
+    logger.info("Bulk import of %s (%s) started from %s", file.filename, fmt, client_ip)
+    
+    def progress(result):
+        logger.info("Bulk import progress: %d rows, %d inserted, %d rejected", result.rows, result.inserted, result.rejected)
+    
+    # The upload is already spooled to disk by Starlette; parse and load it off the event loop
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    try:
+        result = await asyncio.to_thread(import_stream, stream, fmt, on_progress=progress)
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Fichier illisible (encodage UTF-8 attendu)."
+        )
+    except Exception as e:
+        logger.error("Bulk import from %s failed: %s", client_ip, e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="L'import a échoué. Les lots déjà validés ont été enregistrés."
+        )
+    finally:
+        stream.detach()
+    
+    return result.to_dict()
+
+@router.get("/admin/export")
+async def export_subscribers(
+    request: Request,
+    format: str = "csv",
+    created_from: datetime = None,
+    created_to: datetime = None,
+    admin_key: str = None
+):
+    """
+    Stream confirmed subscribers as CSV or NDJSON, excluding unsubscribed addresses (admin endpoint)
+    
+    Optional created_from/created_to (ISO 8601) restrict the export to a
+    creation range [created_from, created_to).
+    """
+    verify_admin_key(request, admin_key)
+    
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Format non supporté (csv ou ndjson)."
+        )
+    
+    logger.info("Subscriber export (%s) requested from %s", format, get_client_ip(request))
+    filename = f"subscribers-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        iter_export(format, created_from=created_from, created_to=created_to),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/admin/analytics")
+async def get_signup_analytics(
+    request: Request,
+    granularity: str = "day",
+    since: datetime = None,
+    until: datetime = None,
+    source: str = None,
+    admin_key: str = None
+):
+    """
+    Signups and unsubscribes per hour or day, by source, with the unsubscribe rate (admin endpoint)
+    
+    Served from the hourly rollup table (see analytics.py), so the cost does
+    not grow with the subscriber history. Defaults to the last 30 days (day)
+    or 48 hours (hour); times are UTC and the range is [since, until).
+    """
+    verify_admin_key(request, admin_key)
+    
+    if granularity not in GRANULARITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Granularité invalide (hour ou day)."
+        )
+    
+    until = until or datetime.utcnow()
+    since = since or until - (timedelta(days=30) if granularity == "day" else timedelta(hours=48))
+    # Rollup buckets are naive UTC
+    since, until = (
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+        for value in (since, until)
+    )
+    if since >= until or (granularity == "hour" and until - since > MAX_HOURLY_RANGE):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Période invalide (31 jours maximum par heure)."
+        )
+    
+    try:
+        return await asyncio.to_thread(signup_analytics.query, granularity, since, until, source)
+    except Exception as e:
+        logger.error("Error reading signup analytics from %s: %s", get_client_ip(request), e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Une erreur interne s'est produite."
+        )
+
+@router.post("/admin/analytics/refresh")
+async def refresh_signup_analytics(request: Request, full: bool = False, admin_key: str = None):
+    """
+    Refresh the analytics rollups now; full=true rebuilds every bucket (admin endpoint)
+    """
+    verify_admin_key(request, admin_key)
+    
+    refreshed = await signup_analytics.refresh_async(full)
+    logger.info("Analytics refresh (full=%s) requested from %s", full, get_client_ip(request))
+    return {"refreshed": refreshed, **signup_analytics.stats()}
+
+@router.get("/admin/rate-limiter")
+async def get_rate_limiter_stats(request: Request, admin_key: str = None):
+    """
+    Rate limiter table size, evictions and block counts (admin endpoint)
+    """
+    verify_admin_key(request, admin_key)
+    return rate_limiter.stats()
+
+@router.get("/admin/coalescer")
+async def get_coalescer_stats(request: Request, admin_key: str = None):
+    """Duplicate signup coalescing statistics (admin endpoint)"""
+    verify_admin_key(request, admin_key)
+    return subscribe_coalescer.stats()
+
+@router.get("/admin/outbox")
+async def get_outbox_stats(request: Request, admin_key: str = None):
+    """Email outbox dispatcher statistics and message counts per status (admin endpoint)"""
+    verify_admin_key(request, admin_key)
+    try:
+        messages = await asyncio.to_thread(outbox_dispatcher.pending_counts)
+    except Exception as e:
+        logger.error("Error reading outbox counts from %s: %s", get_client_ip(request), e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Une erreur interne s'est produite."
+        )
+    return {**outbox_dispatcher.stats(), "messages": messages}
+
+@router.get("/admin/db-pool")
+async def get_db_pool_stats(request: Request, admin_key: str = None):
+    """
+    Database connection pool occupancy: size, checked out and overflow connections (admin endpoint)
+    """
+    verify_admin_key(request, admin_key)
+    return pool_stats()
+
+@router.get("/admin/write-behind")
+async def get_write_behind_stats(request: Request, admin_key: str = None):
+    """
+    Write-behind queue depth, batch counts and spilled rows (admin endpoint)
+    """
+    verify_admin_key(request, admin_key)
+    return write_behind.stats()
+
+@router.get("/admin/blocklist")
+async def get_blocklist_stats(request: Request, admin_key: str = None):
+    """
+    Disposable domain blocklist size, memory footprint and last load time (admin endpoint)
+    """
+    verify_admin_key(request, admin_key)
+    return disposable_domains.stats()
+
+@router.post("/admin/blocklist/reload")
+async def reload_blocklist(request: Request, admin_key: str = None):
+    """
+    Reload the disposable domain list from disk (admin endpoint)
+    """
+    verify_admin_key(request, admin_key)
+    
+    if not await asyncio.to_thread(disposable_domains.reload):
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Blocklist reload failed."
+        )
+    return disposable_domains.stats()
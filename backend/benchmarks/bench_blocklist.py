@@ -0,0 +1,42 @@
+"""
+Disposable domain blocklist benchmark: lookup cost, load time and memory vs. list size
+
+    python -m benchmarks.bench_blocklist
+"""
+import os
+import random
+import string
+import tempfile
+
+from benchmarks.common import measure, report
+from blocklist import DomainBlocklist
+
+def _random_domain(rng: random.Random) -> str:
+    label = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 14)))
+    return f"{label}.{rng.choice(['com', 'net', 'org', 'io', 'fr', 'de'])}"
+
+def bench_list_size(sizes=(1_000, 100_000, 500_000)):
+    rng = random.Random(7)
+    for size in sizes:
+        domains = [_random_domain(rng) for _ in range(size)]
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("\n".join(domains))
+            path = f.name
+        try:
+            blocklist = DomainBlocklist(path, check_interval=0)
+            listed = domains[size // 2]
+            results = {
+                "listed domain": measure(lambda: blocklist.contains(listed), 100_000),
+                "subdomain of listed": measure(lambda: blocklist.contains(f"mx.eu.{listed}"), 100_000),
+                "unlisted domain": measure(lambda: blocklist.contains("nutriflow.fr"), 100_000),
+            }
+            report(f"Blocklist lookups, {size:,} domains", results)
+            report(f"Blocklist load, {size:,} domains", {
+                "load (ms)": blocklist.load_duration * 1000,
+                "memory (MiB)": blocklist.memory_bytes() / (1024 * 1024),
+            }, unit="")
+        finally:
+            os.unlink(path)
+
+if __name__ == "__main__":
+    bench_list_size()
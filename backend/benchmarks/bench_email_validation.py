@@ -0,0 +1,69 @@
+"""
+Email validation benchmark over a corpus of valid and invalid addresses
+
+    python -m benchmarks.bench_email_validation
+"""
+import random
+import string
+
+from pydantic import ValidationError
+
+from api import validate_email_format
+from benchmarks.common import measure, report
+from email_validation import is_valid_email
+from schemas import SubscriberCreate
+
+def build_corpus(size: int = 2_000, seed: int = 42):
+    """Deterministic mix of valid addresses and the invalid shapes seen in practice"""
+    rng = random.Random(seed)
+    letters = string.ascii_lowercase + string.digits
+
+    def word(low=3, high=12):
+        return "".join(rng.choice(letters) for _ in range(rng.randint(low, high)))
+
+    valid, invalid = [], []
+    for _ in range(size):
+        valid.append(f"{word()}.{word()}@{word()}.{rng.choice(['fr', 'com', 'org', 'io'])}")
+    generators = [
+        lambda: f"{word()}@{word()}",                       # no TLD
+        lambda: f"{word()}..{word()}@{word()}.com",         # consecutive dots
+        lambda: f".{word()}@{word()}.com",                  # leading dot
+        lambda: f"{word()}@@{word()}.com",                  # double @
+        lambda: f"{word()}<script>@{word()}.com",           # HTML injection
+        lambda: f"{word()}';--@{word()}.com",               # SQL injection
+        lambda: f"{word()}@mailinator.com",                 # disposable domain
+        lambda: f"{word()}@inbox.guerrillamail.com",        # disposable subdomain
+        lambda: word(20, 40),                               # no @ at all
+        lambda: f"{word(250, 260)}@{word()}.com",           # too long
+    ]
+    for i in range(size):
+        invalid.append(generators[i % len(generators)]())
+    return valid, invalid
+
+def _full_request_validation(email: str) -> bool:
+    """What one /api/subscribe request pays for email validation: parsing SubscriberCreate"""
+    try:
+        SubscriberCreate(email=email)
+    except ValidationError:
+        return False
+    return True
+
+def bench_corpus():
+    valid, invalid = build_corpus()
+    rejected_valid = sum(not _full_request_validation(email) for email in valid)
+    accepted_invalid = sum(_full_request_validation(email) for email in invalid)
+    print(f"Corpus: {len(valid)} valid ({rejected_valid} rejected), {len(invalid)} invalid ({accepted_invalid} accepted)")
+
+    for title, check in (
+        ("Request path (SubscriberCreate) per address", _full_request_validation),
+        ("email_validation.is_valid_email per address", is_valid_email),
+        ("api.validate_email_format per address", validate_email_format),
+    ):
+        results = {}
+        for name, corpus in (("valid addresses", valid), ("invalid addresses", invalid)):
+            position = iter(range(10 ** 9))
+            results[name] = measure(lambda: check(corpus[next(position) % len(corpus)]), 20_000)
+        report(title, results)
+
+if __name__ == "__main__":
+    bench_corpus()
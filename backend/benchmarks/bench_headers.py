@@ -0,0 +1,59 @@
+"""
+Request header validation and client IP extraction micro-benchmarks
+
+    python -m benchmarks.bench_headers
+"""
+import logging
+
+from starlette.requests import Request
+
+from benchmarks.common import measure, report
+from security import get_client_ip, validate_request_headers
+
+USER_AGENTS = {
+    "browser": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "proxy": "nginx-proxy-manager/2.10 healthcheck",
+    "curl": "curl/8.4.0 (x86_64-pc-linux-gnu)",
+    "unknown client": "SomeHttpLibrary/3.2.1 (linux)",
+}
+
+def build_request(user_agent: str, proxy_headers: bool = True) -> Request:
+    """Synthetic POST /api/subscribe request, by default as seen behind the reverse proxy"""
+    headers = [
+        (b"host", b"api.nutriflow.fr"),
+        (b"content-type", b"application/json"),
+        (b"accept", b"application/json"),
+        (b"origin", b"https://nutriflow.fr"),
+        (b"user-agent", user_agent.encode()),
+    ]
+    if proxy_headers:
+        headers += [(b"x-forwarded-for", b"203.0.113.7, 10.0.0.2"), (b"x-real-ip", b"203.0.113.7")]
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/api/subscribe",
+        "headers": headers,
+        "client": ("10.0.0.2", 51234),
+        "query_string": b"",
+    }
+    return Request(scope)
+
+def bench_validate_request_headers():
+    results = {"(request construction only)": measure(lambda: build_request(USER_AGENTS["browser"]), 20_000)}
+    for name, user_agent in USER_AGENTS.items():
+        # A fresh request per call, like the real per-request path
+        results[name] = measure(lambda: validate_request_headers(build_request(user_agent)), 20_000)
+    report("validate_request_headers per request", results)
+
+def bench_get_client_ip():
+    browser = USER_AGENTS["browser"]
+    results = {
+        "X-Forwarded-For": measure(lambda: get_client_ip(build_request(browser)), 20_000),
+        "direct connection": measure(lambda: get_client_ip(build_request(browser, proxy_headers=False)), 20_000),
+    }
+    report("get_client_ip per request (including request construction)", results)
+
+if __name__ == "__main__":
+    logging.getLogger("security").setLevel(logging.ERROR)
+    bench_validate_request_headers()
+    bench_get_client_ip()
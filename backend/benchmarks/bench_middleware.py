@@ -0,0 +1,74 @@
+"""
+Middleware stack throughput: previous BaseHTTPMiddleware functions vs. pure ASGI classes
+
+    python -m benchmarks.bench_middleware
+
+Requests are driven straight through the ASGI interface (no network, no HTTP
+parsing) against a trivial JSON endpoint, so the numbers isolate the cost the
+security and rate limiting layers add per request.
+"""
+import asyncio
+import logging
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from benchmarks.common import report, requests_per_second
+from config import settings
+from security import (
+    RateLimitMiddleware, SecurityHeadersMiddleware, build_security_headers,
+    get_client_ip, rate_limit_key, rate_limiter,
+)
+
+# Baseline: the previous @app.middleware("http") implementations, minus metrics
+
+async def legacy_rate_limit_middleware(request: Request, call_next):
+    client_ip = get_client_ip(request)
+    if request.url.path == "/health":
+        return await call_next(request)
+    is_limited, remaining_time = await rate_limiter.hit(rate_limit_key(client_ip))
+    if is_limited:
+        return JSONResponse(status_code=429, content={"detail": "Accès bloqué."},
+                            headers={"Retry-After": str(remaining_time or 3600)})
+    start_time = time.time()
+    response = await call_next(request)
+    response.headers["X-Process-Time"] = str(round((time.time() - start_time) * 1000, 2))
+    return response
+
+async def legacy_security_headers_middleware(request: Request, call_next):
+    response = await call_next(request)
+    # The old code rebuilt the header dict and CSP string on every response
+    for name, value in build_security_headers(settings.is_production):
+        response.headers[name.decode("latin-1")] = value.decode("latin-1")
+    return response
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"status": "ok"}
+
+    if stack == "base_http":
+        app.middleware("http")(legacy_security_headers_middleware)
+        app.middleware("http")(legacy_rate_limit_middleware)
+    elif stack == "asgi":
+        app.add_middleware(SecurityHeadersMiddleware)
+        app.add_middleware(RateLimitMiddleware)
+    return app
+
+def bench_stacks(total: int = 20_000, repeat: int = 3):
+    # Never rate limit the benchmark traffic
+    settings.RATE_LIMIT_REQUESTS = 10 ** 9
+
+    results = {}
+    for label, stack in (("no middleware", "none"), ("BaseHTTPMiddleware (previous)", "base_http"), ("pure ASGI", "asgi")):
+        app = build_app(stack)
+        results[label] = max(asyncio.run(requests_per_second(app, total, path="/api/ping")) for _ in range(repeat))
+
+    report(f"Middleware stack throughput ({total:,} requests, 50 concurrent)", results, unit="req/s")
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.ERROR)
+    bench_stacks()
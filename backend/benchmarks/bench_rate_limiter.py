@@ -0,0 +1,78 @@
+"""
+Rate limiter micro-benchmark: per-request cost and memory per tracked IP
+
+    python -m benchmarks.bench_rate_limiter
+"""
+import itertools
+import tracemalloc
+
+from benchmarks.common import measure, report
+from config import settings
+from security import InMemoryRateLimiter
+
+def _check_and_record(limiter: InMemoryRateLimiter, client_ip: str):
+    limiter.check_and_record(client_ip)
+
+def bench_client_count(client_counts=(1_000, 10_000, 100_000)):
+    """Cost per request while many distinct clients are tracked"""
+    results = {}
+    for count in client_counts:
+        limiter = InMemoryRateLimiter()
+        ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(count)]
+        for ip in ips:
+            _check_and_record(limiter, ip)
+        cycle = itertools.cycle(ips)
+        results[f"{count:,} clients"] = measure(lambda: _check_and_record(limiter, next(cycle)), 50_000)
+    report("Per-request cost vs. tracked clients", results)
+
+def bench_requests_in_window(request_counts=(10, 1_000, 10_000)):
+    """Cost per request for one client with many requests inside the window"""
+    results = {}
+    for count in request_counts:
+        limiter = InMemoryRateLimiter()
+        for _ in range(count):
+            _check_and_record(limiter, "192.0.2.1")
+        results[f"{count:,} requests in window"] = measure(
+            lambda: _check_and_record(limiter, "192.0.2.1"), 2_000
+        )
+    report("Per-request cost vs. requests in window (single client)", results)
+
+def bench_memory(clients: int = 100_000, requests_per_client: int = 5):
+    """Bytes allocated per tracked IP"""
+    tracemalloc.start()
+    limiter = InMemoryRateLimiter()
+    before, _ = tracemalloc.get_traced_memory()
+    for i in range(clients):
+        ip = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+        for _ in range(requests_per_client):
+            _check_and_record(limiter, ip)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report("Memory per tracked IP", {
+        f"{clients:,} clients x {requests_per_client} requests": (after - before) / clients
+    }, unit="bytes")
+
+def bench_ip_spray(addresses: int = 500_000, max_clients: int = 50_000):
+    """Table size and memory while a flood rotates through many source addresses"""
+    settings.RATE_LIMIT_MAX_CLIENTS = max_clients
+    tracemalloc.start()
+    limiter = InMemoryRateLimiter()
+    before, _ = tracemalloc.get_traced_memory()
+    for i in range(addresses):
+        _check_and_record(limiter, f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = limiter.stats()
+    report(f"IP spray: {addresses:,} addresses, cap {max_clients:,}", {
+        "tracked clients": stats["tracked_clients"],
+        "capacity evictions": stats["capacity_evictions"],
+        "memory (MiB)": (after - before) / (1024 * 1024),
+    }, unit="")
+
+if __name__ == "__main__":
+    # Never block during the benchmark so every call takes the full accounting path
+    settings.RATE_LIMIT_REQUESTS = 10 ** 9
+    bench_client_count()
+    bench_requests_in_window()
+    bench_memory()
+    bench_ip_spray()
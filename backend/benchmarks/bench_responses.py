@@ -0,0 +1,96 @@
+"""
+Response encoding throughput: per-request dict/model serialization vs. orjson and precomputed bodies
+
+    python -m benchmarks.bench_responses
+
+Both apps run the production middleware stack and the same request
+validation; only the response path differs. The subscribe handlers skip the
+database (a fixed subscriber row stands in for the upsert result), so the
+numbers isolate what serializing the response costs per request.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+from fastapi import FastAPI, status
+from fastapi.responses import ORJSONResponse
+
+from api import SUBSCRIBE_QUEUED_RESPONSE, SUBSCRIBE_SUCCESS_MESSAGE, _subscribe_response
+from benchmarks.common import report, requests_per_second
+from config import settings
+from responses import PrecomputedJSON
+from schemas import SubscriberCreate, SubscribeResponse
+from security import RateLimitMiddleware, SecurityHeadersMiddleware
+
+SUBSCRIBER = SimpleNamespace(id=uuid.uuid4(), email="bench@example.com", created_at=datetime.utcnow())
+
+def build_legacy_app() -> FastAPI:
+    """Previous handlers: dicts and SubscribeResponse models through FastAPI's default JSONResponse"""
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "message": "API is running"}
+
+    @app.post("/api/subscribe", response_model=SubscribeResponse, status_code=status.HTTP_201_CREATED)
+    async def subscribe(subscriber_data: SubscriberCreate):
+        return SubscribeResponse(message=SUBSCRIBE_SUCCESS_MESSAGE, subscriber=SUBSCRIBER)
+
+    @app.post("/api/subscribe-queued", response_model=SubscribeResponse, status_code=status.HTTP_202_ACCEPTED)
+    async def subscribe_queued(subscriber_data: SubscriberCreate):
+        return SubscribeResponse(message=SUBSCRIBE_SUCCESS_MESSAGE)
+
+    app.add_middleware(SecurityHeadersMiddleware)
+    app.add_middleware(RateLimitMiddleware)
+    return app
+
+def build_current_app() -> FastAPI:
+    """Current handlers: ORJSONResponse default, precomputed constant bodies"""
+    app = FastAPI(default_response_class=ORJSONResponse)
+    health_response = PrecomputedJSON({"status": "healthy", "message": "API is running"})
+
+    @app.get("/health")
+    async def health():
+        return health_response()
+
+    @app.post("/api/subscribe", response_model=SubscribeResponse, status_code=status.HTTP_201_CREATED)
+    async def subscribe(subscriber_data: SubscriberCreate):
+        return _subscribe_response(SUBSCRIBER)
+
+    @app.post("/api/subscribe-queued", response_model=SubscribeResponse, status_code=status.HTTP_202_ACCEPTED)
+    async def subscribe_queued(subscriber_data: SubscriberCreate):
+        return SUBSCRIBE_QUEUED_RESPONSE()
+
+    app.add_middleware(SecurityHeadersMiddleware)
+    app.add_middleware(RateLimitMiddleware)
+    return app
+
+def bench_endpoints(total: int = 20_000, repeat: int = 3):
+    # Never rate limit the benchmark traffic
+    settings.RATE_LIMIT_REQUESTS = 10 ** 9
+
+    body = json.dumps({"email": "bench@example.com"}).encode()
+    json_headers = [(b"content-type", b"application/json"), (b"user-agent", b"Mozilla/5.0 (bench)")]
+    cases = (
+        ("GET /health", {"path": "/health"}, 200),
+        ("POST /api/subscribe (201)", {"method": "POST", "path": "/api/subscribe", "body": body, "headers": json_headers}, 201),
+        ("POST /api/subscribe (202 queued)", {"method": "POST", "path": "/api/subscribe-queued", "body": body, "headers": json_headers}, 202),
+    )
+    apps = (("previous", build_legacy_app()), ("current", build_current_app()))
+
+    results = {}
+    for case, request, expected_status in cases:
+        for label, app in apps:
+            results[f"{case}, {label}"] = max(
+                asyncio.run(requests_per_second(app, total, expected_status=expected_status, **request))
+                for _ in range(repeat)
+            )
+
+    report(f"Endpoint throughput ({total:,} requests, 50 concurrent)", results, unit="req/s")
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.ERROR)
+    bench_endpoints()
@@ -0,0 +1,128 @@
+"""
+Shared helpers for the micro-benchmarks (run from the backend directory,
+e.g. ``python -m benchmarks.bench_rate_limiter``)
+
+Every table printed with report() is also collected in RESULTS, which
+benchmarks.suite saves as JSON and compares across runs.
+"""
+import asyncio
+import itertools
+import json
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+RESULTS: Dict[str, Dict] = {}
+
+# Sign of an improvement per unit; tables in other units are compared without a verdict
+_DIRECTIONS = {"ns/op": -1, "ms": -1, "bytes": -1, "req/s": 1}
+
+def measure(func: Callable[[], None], iterations: int, repeat: int = 5) -> float:
+    """Best-of-``repeat`` cost of ``func`` in nanoseconds per call"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            func()
+        best = min(best, (time.perf_counter_ns() - start) / iterations)
+    return best
+
+def report(title: str, results: Dict[str, float], unit: str = "ns/op"):
+    """Print one aligned table of results and record it in RESULTS"""
+    RESULTS[title] = {"unit": unit, "results": dict(results)}
+    print(f"\n{title}")
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print(f"  {name.ljust(width)}  {value:>12,.1f} {unit}")
+
+async def asgi_request(
+    app,
+    method: str = "GET",
+    path: str = "/",
+    body: bytes = b"",
+    headers: Iterable[Tuple[bytes, bytes]] = (),
+    client_ip: bytes = b"203.0.113.1",
+) -> int:
+    """Drive one request straight through the ASGI interface and return the status code"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"api.nutriflow.fr"), (b"x-forwarded-for", client_ip), *headers],
+        "client": ("10.0.0.2", 51234),
+        "server": ("testserver", 80),
+    }
+    status_code = None
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive():
+        # Like a real server: the body once, then block until the client goes away
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            response_done.set()
+
+    await app(scope, receive, send)
+    return status_code
+
+async def requests_per_second(app, total: int, concurrency: int = 50, expected_status: int = 200, **request) -> float:
+    """Throughput of ``total`` identical requests issued by ``concurrency`` concurrent clients"""
+    clients = itertools.cycle([f"203.0.{i >> 8}.{i & 255}".encode() for i in range(1000)])
+    # Warm up outside the timing (builds the middleware stack)
+    assert await asgi_request(app, client_ip=next(clients), **request) == expected_status
+
+    async def worker(count: int):
+        for _ in range(count):
+            status_code = await asgi_request(app, client_ip=next(clients), **request)
+            assert status_code == expected_status, status_code
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(total // concurrency) for _ in range(concurrency)))
+    return total / (time.perf_counter() - start)
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def save_results(path: str, results: Dict):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"\nResults written to {path}")
+
+def compare_results(baseline: Dict[str, Dict], current: Dict[str, Dict]):
+    """Print the relative change of every value present in both runs' tables"""
+    print("\nChange vs. baseline (+ is better)")
+    for title, table in current.items():
+        previous = baseline.get(title)
+        if not previous:
+            continue
+        direction = _DIRECTIONS.get(table["unit"])
+        print(f"\n{title}")
+        width = max(len(name) for name in table["results"])
+        for name, value in table["results"].items():
+            old = previous["results"].get(name)
+            if not isinstance(old, (int, float)) or not isinstance(value, (int, float)):
+                continue
+            line = f"  {name.ljust(width)}  {old:>12,.1f} -> {value:>12,.1f} {table['unit']}"
+            if direction and old:
+                line += f"  {direction * (value - old) / old:+7.1%}"
+            print(line)
@@ -0,0 +1,156 @@
+"""
+End-to-end load test of the signup API, in process through the ASGI interface
+
+    python -m benchmarks.load_test [--requests 2000] [--concurrency 20]
+                                   [--database-url postgresql://...]
+                                   [--output results.json] [--compare baseline.json]
+
+The real application (main.app, with its middleware stack, startup hooks and
+database) serves /health, /api/subscribe and /api/unsubscribe. Requests skip
+the network and HTTP parsing, so the numbers cover what the app itself adds.
+By default a throwaway SQLite file is used; pass --database-url to run
+against a local PostgreSQL instead (use a scratch database: the test writes
+subscribers and suppressions).
+
+Each scenario reports throughput and p50/p90/p99/max latency. Settings must be
+in the environment before config is imported, so configure_environment() runs
+before the app is loaded.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from benchmarks.common import RESULTS, asgi_request, compare_results, percentile, report, save_results
+
+JSON_HEADERS = [(b"content-type", b"application/json"), (b"user-agent", b"Mozilla/5.0 (load test)")]
+
+def configure_environment(database_url: Optional[str] = None) -> str:
+    """Point the app at the benchmark database and disable what would skew the numbers"""
+    if not database_url:
+        handle, path = tempfile.mkstemp(prefix="nutriflow-load-", suffix=".db")
+        os.close(handle)
+        database_url = f"sqlite:///{path}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("RATE_LIMIT_REQUESTS", str(10 ** 9))
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    os.environ.setdefault("ANALYTICS_ENABLED", "False")
+    return database_url
+
+async def _run_scenario(app, name: str, requests: List[Dict], expected_status: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    pending = iter(enumerate(requests))
+
+    async def worker():
+        nonlocal errors
+        for index, request in pending:
+            started = time.perf_counter()
+            status_code = await asgi_request(app, client_ip=f"198.18.{index >> 8 & 255}.{index & 255}".encode(), **request)
+            latencies.append(time.perf_counter() - started)
+            if status_code != expected_status:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "throughput (req/s)": len(requests) / elapsed,
+        "p50 (ms)": percentile(latencies, 0.50) * 1000,
+        "p90 (ms)": percentile(latencies, 0.90) * 1000,
+        "p99 (ms)": percentile(latencies, 0.99) * 1000,
+        "max (ms)": latencies[-1] * 1000,
+        "errors": errors,
+    }
+    report(f"Load test: {name}", {key: value for key, value in result.items() if key.startswith("throughput")}, unit="req/s")
+    report(f"Load test latency: {name}", {key: value for key, value in result.items() if key.endswith("(ms)")}, unit="ms")
+    if errors:
+        print(f"  {errors} of {len(requests)} requests did not return {expected_status}")
+    return result
+
+async def run_load_test(total: int = 2000, concurrency: int = 20) -> Dict[str, Dict]:
+    """Drive every scenario against main.app and return the per-scenario results"""
+    import main  # after configure_environment()
+
+    app = main.app
+    await app.router.startup()
+    await app.state.warm_up_task  # schema, pool and write-behind queue ready
+    try:
+        run_id = uuid.uuid4().hex[:8]
+        emails = [f"load-{run_id}-{i}@example.com" for i in range(total)]
+        bodies = [json.dumps({"email": email}).encode() for email in emails]
+        scenarios = (
+            ("GET /health", [{"path": "/health"}] * total, 200),
+            ("POST /api/subscribe", [
+                {"method": "POST", "path": "/api/subscribe", "body": body, "headers": JSON_HEADERS} for body in bodies
+            ], 202 if main.settings.WRITE_BEHIND_ENABLED else 201),
+            ("POST /api/unsubscribe", [
+                {"method": "POST", "path": "/api/unsubscribe", "body": body, "headers": JSON_HEADERS} for body in bodies
+            ], 200),
+        )
+
+        # Warm up outside the timing (builds the middleware stack, opens connections)
+        await asgi_request(app, path="/health")
+
+        results = {}
+        for name, requests, expected_status in scenarios:
+            results[name] = await _run_scenario(app, name, requests, expected_status, concurrency)
+            if name == "POST /api/subscribe" and main.write_behind.queue is not None:
+                await main.write_behind.queue.join()  # unsubscribe needs the rows written
+        return results
+    finally:
+        await app.router.shutdown()
+
+def environment_info(database_url: str) -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "database": database_url.split("://", 1)[0],
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="In-process load test of the signup API")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file from a previous run")
+    args = parser.parse_args(argv)
+
+    database_url = configure_environment(args.database_url)
+    try:
+        logging.getLogger().setLevel(logging.ERROR)
+        asyncio.run(run_load_test(args.requests, args.concurrency))
+    finally:
+        if not args.database_url:
+            os.unlink(database_url[len("sqlite:///"):])
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f)["results"], RESULTS)
+    if args.output:
+        info = environment_info(database_url)
+        info.update(requests=args.requests, concurrency=args.concurrency)
+        save_results(args.output, {"environment": info, "results": RESULTS})
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+"""
+Benchmark suite: micro-benchmarks plus the end-to-end load test, saved as JSON
+
+    python -m benchmarks.suite [--compare benchmarks/results/<baseline>.json]
+                               [--skip-load] [--database-url postgresql://...]
+
+Runs the email validation, header validation, client IP and rate limiter
+micro-benchmarks, then benchmarks.load_test, and writes every table to
+benchmarks/results/<timestamp>-<commit>.json (or --output). With --compare,
+each value is printed next to the baseline run with its relative change, so a
+change to security.py or services.py can be checked before it is merged.
+Compare runs from the same machine and database only.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+
+from benchmarks.common import RESULTS, compare_results, save_results
+from benchmarks.load_test import configure_environment, environment_info, run_load_test
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def run_micro_benchmarks():
+    # Imported after configure_environment(): these modules load config
+    from benchmarks import bench_email_validation, bench_headers, bench_rate_limiter
+    from config import settings
+
+    bench_email_validation.bench_corpus()
+    bench_headers.bench_validate_request_headers()
+    bench_headers.bench_get_client_ip()
+
+    limit = settings.RATE_LIMIT_REQUESTS
+    settings.RATE_LIMIT_REQUESTS = 10 ** 9
+    try:
+        bench_rate_limiter.bench_client_count()
+        bench_rate_limiter.bench_requests_in_window()
+        bench_rate_limiter.bench_memory()
+    finally:
+        settings.RATE_LIMIT_REQUESTS = limit
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and save the results as JSON")
+    parser.add_argument("--output", help="defaults to benchmarks/results/<timestamp>-<commit>.json")
+    parser.add_argument("--compare", help="baseline JSON file from a previous run")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--requests", type=int, default=2000, help="load test requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--database-url", help="load test database, defaults to a temporary SQLite file")
+    args = parser.parse_args(argv)
+
+    database_url = configure_environment(args.database_url)
+    logging.getLogger().setLevel(logging.ERROR)
+    try:
+        if not args.skip_micro:
+            run_micro_benchmarks()
+        if not args.skip_load:
+            asyncio.run(run_load_test(args.requests, args.concurrency))
+    finally:
+        if not args.database_url:
+            os.unlink(database_url[len("sqlite:///"):])
+
+    info = environment_info(database_url)
+    info.update(requests=args.requests, concurrency=args.concurrency)
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f)["results"], RESULTS)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = info["timestamp"].replace(":", "") + (f"-{info['commit']}" if info["commit"] else "")
+        output = os.path.join(RESULTS_DIR, f"{name}.json")
+    save_results(output, {"environment": info, "results": RESULTS})
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,128 @@
+"""
+Disposable email domain blocklist with live reload
+
+Domains are held in a frozenset; a lookup walks the labels of the queried
+domain from most to least specific, so subdomains of a listed domain match and
+each lookup costs a handful of hash probes whatever the list size. A hashed
+set is used rather than a label trie: it needs far less memory per entry in
+Python and gives the same O(labels) lookups.
+
+The list is re-read when its file changes (checked at most every
+DISPOSABLE_DOMAINS_CHECK_INTERVAL seconds) or on SIGHUP. Reloads run in a
+background thread and swap the set in one assignment, so lookups never wait.
+"""
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Dict, FrozenSet, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+def load_domains(path: str) -> FrozenSet[str]:
+    """Read a domain list file (one domain per line, '#' comments) into a hashed set"""
+    with open(path, "r") as f:
+        return frozenset(
+            line.strip().lower().lstrip("*.").rstrip(".")
+            for line in f
+            if line.strip() and not line.lstrip().startswith("#")
+        )
+
+class DomainBlocklist:
+    """Hashed-set domain blocklist that reloads itself without blocking lookups"""
+
+    def __init__(self, path: str, check_interval: float = 30):
+        self.path = path
+        self.check_interval = check_interval
+        self.domains: FrozenSet[str] = frozenset()
+        self.loaded_at: Optional[float] = None
+        self.load_duration: Optional[float] = None
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+        self.reload()
+
+    def contains(self, domain: str) -> bool:
+        """True if the domain or any parent domain (above the TLD) is listed"""
+        if self.check_interval > 0:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._next_check = now + self.check_interval
+                self._reload_if_changed()
+
+        domains = self.domains
+        while True:
+            if domain in domains:
+                return True
+            _, dot, domain = domain.partition(".")
+            if not dot or "." not in domain:
+                return False
+
+    __contains__ = contains
+
+    def reload(self) -> bool:
+        """Re-read the list file and swap it in; returns False if it could not be read"""
+        if not self._reload_lock.acquire(blocking=False):
+            return False  # Another reload is already running
+        try:
+            started = time.perf_counter()
+            try:
+                mtime = os.stat(self.path).st_mtime
+                domains = load_domains(self.path)
+            except OSError as e:
+                logger.warning("Disposable domain list not loaded from %s: %s", self.path, e)
+                return False
+
+            self.domains = domains
+            self._mtime = mtime
+            self.loaded_at = time.time()
+            self.load_duration = time.perf_counter() - started
+            logger.info("Loaded %d disposable domains from %s in %.2fms", len(domains), self.path, self.load_duration * 1000)
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def reload_in_background(self):
+        threading.Thread(target=self.reload, name="blocklist-reload", daemon=True).start()
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload_in_background()
+
+    def install_sighup_handler(self, loop: asyncio.AbstractEventLoop):
+        """Reload the list when the process receives SIGHUP"""
+        if not hasattr(signal, "SIGHUP"):
+            return
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.reload_in_background)
+        except (NotImplementedError, RuntimeError, ValueError) as e:
+            logger.warning("SIGHUP reload not available: %s", e)
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the set and its strings"""
+        domains = self.domains
+        return sys.getsizeof(domains) + sum(sys.getsizeof(domain) for domain in domains)
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "domains": len(self.domains),
+            "memory_bytes": self.memory_bytes(),
+            "loaded_at": self.loaded_at,
+            "load_duration_ms": round(self.load_duration * 1000, 2) if self.load_duration else None,
+        }
+
+# Global disposable domain blocklist
+disposable_domains = DomainBlocklist(
+    settings.DISPOSABLE_DOMAINS_FILE,
+    check_interval=settings.DISPOSABLE_DOMAINS_CHECK_INTERVAL
+)
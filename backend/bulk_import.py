@@ -0,0 +1,257 @@
+"""
+Bulk subscriber import from CSV or NDJSON
+
+Usage:
+    python bulk_import.py subscribers.csv [--format csv|ndjson] [--rejects rejects.csv] [--batch-size 10000]
+
+The file is streamed: rows are validated with the same rules as
+SubscriberCreate (see email_validation) and written in fixed-size batches, so
+memory stays constant whatever the file size. On PostgreSQL each batch is
+COPYed into a temporary staging table and merged into subscribers with
+INSERT ... SELECT DISTINCT ... ON CONFLICT DO NOTHING; other databases use a
+multi-row INSERT ... ON CONFLICT per batch. Each batch commits on its own, so
+an interrupted import can simply be run again.
+
+Also available as POST /api/admin/import (multipart upload).
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from database import engine, SessionLocal, ensure_schema
+from email_validation import validate_email
+from counting import subscriber_counter
+from services import _bulk_insert_statement
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000
+MAX_REPORTED_REJECTS = 1000  # rejects kept in the result; the CLI writes all of them to a file
+
+STAGING_TABLE = "subscriber_import"
+IMPORT_SOURCE = "import"  # subscribers.source for imported rows
+# Imported lists were opted in where they were collected: rows are stored as
+# confirmed and no confirmation email is sent
+
+class ImportResult:
+    """Running counters for one import, reported as progress and at the end"""
+
+    def __init__(self):
+        self.rows = 0
+        self.valid = 0
+        self.rejected = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.rejects: List[Dict] = []
+        self.started = time.time()
+
+    def reject(self, line: int, value: str, reason: str):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({"line": line, "value": value, "reason": reason})
+
+    def to_dict(self) -> Dict:
+        elapsed = time.time() - self.started
+        return {
+            "rows": self.rows,
+            "valid": self.valid,
+            "rejected": self.rejected,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "duration_s": round(elapsed, 2),
+            "rows_per_s": round(self.rows / elapsed) if elapsed > 0 else None,
+            "rejects": self.rejects,
+            "rejects_truncated": self.rejected > len(self.rejects),
+        }
+
+def detect_format(filename: str) -> str:
+    """'ndjson' for .ndjson/.jsonl files, 'csv' otherwise"""
+    return "ndjson" if filename.lower().endswith((".ndjson", ".jsonl")) else "csv"
+
+def iter_rows(stream: TextIO, fmt: str) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (line number, raw email) pairs from a CSV or NDJSON stream
+
+    CSV files use their "email" column when the first row is a header, the
+    first column otherwise. NDJSON lines must be objects with an "email" key.
+    Unparseable rows are yielded with a None email.
+    """
+    if fmt == "ndjson":
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield line_number, record.get("email") if isinstance(record, dict) else None
+            except ValueError:
+                yield line_number, None
+        return
+
+    reader = csv.reader(stream)
+    column = 0
+    for row in reader:
+        if reader.line_num == 1:
+            header = [cell.strip().lower() for cell in row]
+            if "email" in header:
+                column = header.index("email")
+                continue
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        yield reader.line_num, row[column] if column < len(row) else None
+
+def _copy_batch(emails: List[str]) -> int:
+    """PostgreSQL: COPY the batch into the staging table, merge it, return rows inserted"""
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (email VARCHAR(255) NOT NULL) ON COMMIT DELETE ROWS"
+        )
+        # Validated emails contain no tabs, newlines or backslashes, so COPY text format needs no escaping
+        cursor.copy_expert(f"COPY {STAGING_TABLE} (email) FROM STDIN", io.StringIO("\n".join(emails) + "\n"))
+        cursor.execute(
+            f"INSERT INTO subscribers (id, email, source, created_at, confirmed_at) "
+            f"SELECT gen_random_uuid(), email, %s, NOW(), NOW() FROM (SELECT DISTINCT email FROM {STAGING_TABLE}) AS staged "
+            f"ON CONFLICT (email) DO NOTHING",
+            (IMPORT_SOURCE,)
+        )
+        inserted = cursor.rowcount
+        connection.commit()
+        return inserted
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+def _insert_batch(emails: List[str]) -> int:
+    """Other databases: one multi-row INSERT ... ON CONFLICT DO NOTHING per chunk"""
+    db = SessionLocal()
+    try:
+        inserted = 0
+        dialect_name = db.get_bind().dialect.name
+        for start in range(0, len(emails), 500):  # stay under SQLite's bound parameter limit
+            entries = [(email, IMPORT_SOURCE) for email in emails[start:start + 500]]
+            result = db.execute(_bulk_insert_statement(dialect_name, entries, confirmed=True))
+            inserted += len(result.all())
+        db.commit()
+        return inserted
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _write_batch(emails: List[str], result: ImportResult):
+    emails = list(dict.fromkeys(emails))
+    write = _copy_batch if engine.dialect.name == "postgresql" else _insert_batch
+    inserted = write(emails)
+    subscriber_counter.add(inserted)
+    result.batches += 1
+    result.inserted += inserted
+    result.duplicates = result.valid - result.inserted
+
+def import_stream(
+    stream: TextIO,
+    fmt: str = "csv",
+    batch_size: int = BATCH_SIZE,
+    on_progress: Optional[Callable[[ImportResult], None]] = None,
+    on_reject: Optional[Callable[[int, str, str], None]] = None,
+) -> ImportResult:
+    """
+    Validate and load every row of a CSV/NDJSON stream
+
+    Args:
+        stream: Text stream to read line by line
+        fmt: "csv" or "ndjson"
+        batch_size: Rows per COPY/merge transaction
+        on_progress: Called after each batch with the running result
+        on_reject: Called for every rejected row with (line, value, reason)
+
+    Returns:
+        Final import counters and the first rejects
+    """
+    result = ImportResult()
+    batch: List[str] = []
+    for line_number, raw in iter_rows(stream, fmt):
+        result.rows += 1
+        try:
+            if raw is None:
+                raise ValueError("Unreadable row")
+            email = validate_email(raw)
+        except ValueError as e:
+            value = "" if raw is None else str(raw)[:254]
+            result.reject(line_number, value, str(e))
+            if on_reject:
+                on_reject(line_number, value, str(e))
+            continue
+
+        result.valid += 1
+        batch.append(email)
+        if len(batch) >= batch_size:
+            _write_batch(batch, result)
+            batch = []
+            if on_progress:
+                on_progress(result)
+
+    if batch:
+        _write_batch(batch, result)
+        if on_progress:
+            on_progress(result)
+
+    logger.info(
+        "Bulk import: %d rows, %d inserted, %d duplicates, %d rejected",
+        result.rows, result.inserted, result.duplicates, result.rejected
+    )
+    return result
+
+def main(argv: Iterable[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Import subscribers from a CSV or NDJSON file")
+    parser.add_argument("path", help="CSV (email column or first column) or NDJSON file")
+    parser.add_argument("--format", choices=("csv", "ndjson"), help="defaults to the file extension")
+    parser.add_argument("--rejects", help="write every rejected row to this CSV file")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    ensure_schema()
+    rejects_file = open(args.rejects, "w", newline="") if args.rejects else None
+    rejects_writer = csv.writer(rejects_file) if rejects_file else None
+    if rejects_writer:
+        rejects_writer.writerow(["line", "value", "reason"])
+
+    def progress(result: ImportResult):
+        print(
+            f"\r{result.rows:,} rows, {result.inserted:,} inserted, "
+            f"{result.duplicates:,} duplicates, {result.rejected:,} rejected",
+            end="", file=sys.stderr, flush=True
+        )
+
+    try:
+        with open(args.path, "r", encoding="utf-8", newline="") as stream:
+            result = import_stream(
+                stream,
+                fmt=args.format or detect_format(args.path),
+                batch_size=args.batch_size,
+                on_progress=progress,
+                on_reject=(lambda *row: rejects_writer.writerow(row)) if rejects_writer else None,
+            )
+    finally:
+        if rejects_file:
+            rejects_file.close()
+
+    print(file=sys.stderr)
+    summary = result.to_dict()
+    summary.pop("rejects")
+    print(json.dumps(summary, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+In-flight request coalescing with a short-lived result cache
+
+Double-clicked signup buttons and frontend retries send the same request
+several times within milliseconds. RequestCoalescer.run(key, operation) lets
+the first caller for a key run the operation; callers arriving while it is
+in flight await the same result instead of starting their own, and callers
+arriving within COALESCE_TTL seconds afterwards get the cached result. run()
+tells callers whether the result was produced for them or shared, so they
+can answer a duplicate as a duplicate. Only successful results are cached: a
+failure is shared with the callers already waiting, the next caller tries
+again.
+
+State is per process, like the rate limiter's memory backend and the
+membership filter: duplicates landing on different workers still reach the
+database, where the upsert keeps them harmless.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from config import settings
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+coalesced_requests = registry.counter(
+    "nutriflow_coalesced_requests_total",
+    "Requests by coalescing outcome (executed, joined an in-flight operation, served from cache)",
+    ("outcome",),
+)
+
+_MISSING = object()
+
+class RequestCoalescer:
+    """Per-key single flight plus a bounded TTL cache of successful results"""
+
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.enabled = settings.COALESCE_ENABLED
+        self.ttl = settings.COALESCE_TTL if ttl is None else ttl
+        self.max_entries = settings.COALESCE_MAX_ENTRIES if max_entries is None else max_entries
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # key -> (expires_at, result), in insertion order, i.e. expiry order
+        self._results: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.executed = 0
+        self.joined = 0
+        self.cache_hits = 0
+
+    def _cached(self, key: str, now: float) -> Any:
+        entry = self._results.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, result = entry
+        if expires_at <= now:
+            del self._results[key]
+            return _MISSING
+        return result
+
+    def _store(self, key: str, result: Any, now: float):
+        if self.ttl <= 0:
+            return
+        self._results.pop(key, None)
+        self._results[key] = (now + self.ttl, result)
+        # Drop expired entries from the front, then the oldest ones over the bound
+        while self._results:
+            oldest_key, (expires_at, _) = next(iter(self._results.items()))
+            if expires_at > now and len(self._results) <= self.max_entries:
+                break
+            del self._results[oldest_key]
+
+    async def run(self, key: str, operation: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run operation once for concurrent and recent callers with the same key
+
+        Args:
+            key: Identity of the request (e.g. normalized email or idempotency key)
+            operation: Coroutine function performing the work
+
+        Returns:
+            Tuple of (result, shared) where shared is True if the result was
+            produced for another caller (joined in flight or cached)
+        """
+        if not self.enabled:
+            return await operation(), False
+
+        result = self._cached(key, time.monotonic())
+        if result is not _MISSING:
+            self.cache_hits += 1
+            coalesced_requests.inc("cache_hit")
+            return result, True
+
+        while key in self._inflight:
+            future = self._inflight[key]
+            self.joined += 1
+            coalesced_requests.inc("joined")
+            try:
+                # shield: a waiter going away must not cancel the shared operation
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # this waiter was cancelled
+                # The caller running the operation was cancelled: run it ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.executed += 1
+        coalesced_requests.inc("executed")
+        try:
+            result = await operation()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved here so an unawaited failure is not logged as such
+            raise
+        finally:
+            del self._inflight[key]
+
+        future.set_result(result)
+        self._store(key, result, time.monotonic())
+        return result, False
+
+    def clear(self):
+        self._results.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "ttl_s": self.ttl,
+            "in_flight": len(self._inflight),
+            "cached_results": len(self._results),
+            "max_entries": self.max_entries,
+            "executed": self.executed,
+            "joined": self.joined,
+            "cache_hits": self.cache_hits,
+        }
+
+# Global coalescer for /api/subscribe
+subscribe_coalescer = RequestCoalescer()
@@ -0,0 +1,169 @@
+"""
+Double opt-in confirmation tokens and emails
+
+A token is ``<base64url(email)>.<expiry>.<signature>`` where the signature is
+HMAC-SHA256 over the first two parts with SECRET_KEY. Nothing is stored per
+token: /api/confirm checks the signature and expiry, then sets
+subscribers.confirmed_at. Confirming twice is harmless. SECRET_KEY must be
+set explicitly (and shared by every worker and replica): the generated
+default differs per process, so links would only verify on the worker that
+created them.
+
+Confirmation emails are not sent from the request: confirmation_outbox_insert()
+builds the email_outbox rows, which callers add to the transaction that
+creates the subscribers, and outbox.py delivers them.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import exists, insert, literal, or_, select
+
+from config import settings
+from database import EmailOutbox
+
+CONFIRMATION_KIND = "confirmation"
+CONFIRMATION_SUBJECT = "Confirmez votre inscription à NutriFlow"
+MAX_TOKEN_LENGTH = 1024
+
+# Keeps these signatures distinct from any other use of SECRET_KEY
+_TOKEN_PURPOSE = b"nutriflow-confirm-subscription\x00"
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _signature(payload: str) -> str:
+    digest = hmac.new(settings.SECRET_KEY.encode(), _TOKEN_PURPOSE + payload.encode("ascii"), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+def make_confirmation_token(email: str, now: Optional[float] = None) -> str:
+    """
+    Signed token confirming email, valid for CONFIRMATION_TOKEN_TTL seconds
+
+    Args:
+        email: Normalized email address
+        now: Current Unix time (defaults to time.time())
+
+    Returns:
+        URL-safe token
+    """
+    expires = int((time.time() if now is None else now) + settings.CONFIRMATION_TOKEN_TTL)
+    payload = f"{_b64encode(email.encode('utf-8'))}.{expires}"
+    return f"{payload}.{_signature(payload)}"
+
+def verify_confirmation_token(token: str, now: Optional[float] = None) -> Optional[str]:
+    """
+    Check a confirmation token
+
+    Args:
+        token: Token from the confirmation link
+        now: Current Unix time (defaults to time.time())
+
+    Returns:
+        The confirmed email, or None if the token is malformed, forged or expired
+    """
+    if not token or len(token) > MAX_TOKEN_LENGTH:
+        return None
+    try:
+        encoded_email, expires, signature = token.split(".")
+        payload = f"{encoded_email}.{expires}"
+        if not hmac.compare_digest(signature, _signature(payload)):
+            return None
+        if int(expires) < (time.time() if now is None else now):
+            return None
+        return _b64decode(encoded_email).decode("utf-8")
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        return None
+
+def confirmation_link(email: str) -> str:
+    separator = "&" if "?" in settings.CONFIRMATION_URL else "?"
+    return f"{settings.CONFIRMATION_URL}{separator}token={make_confirmation_token(email)}"
+
+def confirmation_body(email: str) -> str:
+    days = max(1, settings.CONFIRMATION_TOKEN_TTL // 86400)
+    return (
+        "Bonjour,\n\n"
+        "Merci pour votre inscription à NutriFlow ! Pour la confirmer et commencer votre "
+        "essai gratuit de 14 jours, cliquez sur le lien ci-dessous :\n\n"
+        f"{confirmation_link(email)}\n\n"
+        f"Ce lien est valable {days} jour{'s' if days > 1 else ''}. Si vous n'êtes pas à l'origine "
+        "de cette inscription, ignorez simplement cet email.\n\n"
+        "L'équipe NutriFlow\n"
+    )
+
+def confirmation_outbox_insert(emails: Iterable[str]):
+    """
+    INSERT of one confirmation email per address into email_outbox
+
+    Execute it in the transaction that creates the subscribers, so a
+    subscriber is never committed without its email (or the reverse).
+
+    Args:
+        emails: Newly created, unconfirmed subscribers
+
+    Returns:
+        Insert statement, or None when there is nothing to send
+    """
+    now = datetime.utcnow()
+    rows = [
+        {
+            "kind": CONFIRMATION_KIND,
+            "recipient": email,
+            "subject": CONFIRMATION_SUBJECT,
+            "body": confirmation_body(email),
+            "next_attempt_at": now,
+            "created_at": now,
+        }
+        for email in emails
+    ]
+    return insert(EmailOutbox).values(rows) if rows else None
+
+def confirmation_resend_insert(email: str):
+    """
+    INSERT of a new confirmation email for a subscriber who is still pending
+
+    Throttled in the statement itself (INSERT ... SELECT ... WHERE NOT
+    EXISTS): nothing is inserted while a confirmation for the address is
+    still pending or one was queued less than CONFIRMATION_RESEND_INTERVAL
+    seconds ago, so repeated form submissions cannot flood the inbox.
+
+    Args:
+        email: Normalized address of an unconfirmed subscriber
+
+    Returns:
+        Insert statement (rowcount 0 when throttled)
+    """
+    now = datetime.utcnow()
+    recent = exists().where(
+        EmailOutbox.kind == CONFIRMATION_KIND,
+        EmailOutbox.recipient == email,
+        or_(
+            EmailOutbox.status == "pending",
+            EmailOutbox.created_at > now - timedelta(seconds=settings.CONFIRMATION_RESEND_INTERVAL),
+        ),
+    )
+    row = select(
+        literal(CONFIRMATION_KIND), literal(email), literal(CONFIRMATION_SUBJECT),
+        literal(confirmation_body(email)), literal(now), literal(now)
+    ).where(~recent)
+    columns = ["kind", "recipient", "subject", "body", "next_attempt_at", "created_at"]
+    return insert(EmailOutbox).from_select(columns, row)
+
+def initial_confirmed_at(confirmed: Optional[bool] = None) -> Optional[datetime]:
+    """
+    confirmed_at for a new subscriber
+
+    Args:
+        confirmed: True for subscribers that need no confirmation (imports);
+            None follows DOUBLE_OPT_IN_ENABLED
+    """
+    if confirmed is None:
+        confirmed = not settings.DOUBLE_OPT_IN_ENABLED
+    return datetime.utcnow() if confirmed else None
@@ -0,0 +1,84 @@
+"""
+Subscriber counts for the admin endpoint without a table scan per call
+
+Modes (``/api/subscribers/count?mode=...``):
+- exact: COUNT(*) on every call
+- cached: exact count reused for SUBSCRIBER_COUNT_CACHE_TTL seconds
+- incremental: in-process counter seeded from an exact count and bumped on
+  every insert made by this process; re-seeded every
+  SUBSCRIBER_COUNT_RECONCILE_INTERVAL seconds to fold in other workers' writes
+- estimate: PostgreSQL planner statistics (pg_class.reltuples), falling back
+  to cached on other databases or before the table was first analyzed
+
+Unsubscribing adds to the suppressions table and keeps the subscriber row, so
+it does not change these counts.
+"""
+import asyncio
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from config import settings
+
+COUNT_MODES = ("exact", "cached", "incremental", "estimate")
+
+class SubscriberCounter:
+    """Cached and incrementally maintained subscriber counts"""
+
+    def __init__(self):
+        self.cache_ttl = settings.SUBSCRIBER_COUNT_CACHE_TTL
+        self.reconcile_interval = settings.SUBSCRIBER_COUNT_RECONCILE_INTERVAL
+        self._cached: Optional[int] = None
+        self._cached_at = 0.0
+        self._running: Optional[int] = None
+        self._seeded_at = 0.0
+        self._lock = threading.Lock()  # add() is also called from worker threads
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    def add(self, count: int = 1):
+        """Record rows inserted by this process"""
+        if count <= 0:
+            return
+        with self._lock:
+            if self._running is not None:
+                self._running += count
+
+    async def cached(self, load: Callable[[], Awaitable[int]]) -> int:
+        """Exact count, recomputed at most once per TTL even under concurrent polling"""
+        if self._cached is not None and time.monotonic() - self._cached_at < self.cache_ttl:
+            return self._cached
+        async with self._get_refresh_lock():
+            if self._cached is None or time.monotonic() - self._cached_at >= self.cache_ttl:
+                self._cached = await load()
+                self._cached_at = time.monotonic()
+            return self._cached
+
+    async def incremental(self, load: Callable[[], Awaitable[int]]) -> int:
+        """Running counter, re-seeded from an exact count every reconcile interval"""
+        if self._running is not None and time.monotonic() - self._seeded_at < self.reconcile_interval:
+            return self._running
+        async with self._get_refresh_lock():
+            if self._running is None or time.monotonic() - self._seeded_at >= self.reconcile_interval:
+                # Inserts that land while the COUNT runs may be counted twice until the next reconcile
+                count = await load()
+                with self._lock:
+                    self._running = count
+                    self._seeded_at = time.monotonic()
+            return self._running
+
+    def _get_refresh_lock(self) -> asyncio.Lock:
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        return self._refresh_lock
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "cached": self._cached,
+            "cached_age_s": round(now - self._cached_at, 1) if self._cached is not None else None,
+            "incremental": self._running,
+            "incremental_age_s": round(now - self._seeded_at, 1) if self._running is not None else None,
+        }
+
+# Global subscriber counter
+subscriber_counter = SubscriberCounter()
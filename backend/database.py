@@ -1,18 +1,148 @@
-from sqlalchemy import create_engine, Column, String, DateTime, Text
+from sqlalchemy import create_engine, event, inspect, select, delete, text, Column, String, DateTime, Integer, Text, Index, Uuid
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateIndex, CreateTable
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from datetime import datetime
+import hashlib
+import logging
+import time
 import uuid
 
 from config import settings
+from metrics import db_checkout_duration, registry
+
+logger = logging.getLogger(__name__)
+
+class _CheckoutTimer:
+    """
+    Pool mixin recording how long each checkout waits for a connection
+    
+    Timed inside the pool, so only sessions that actually run a statement
+    are measured: sessions stay lazy and requests that never query (queued
+    or coalesced signups, rejected tokens) take no connection.
+    """
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_checkout_duration.observe(time.perf_counter() - started)
+
+class _TimedQueuePool(_CheckoutTimer, QueuePool):
+    pass
+
+class _TimedAsyncQueuePool(_CheckoutTimer, AsyncAdaptedQueuePool):
+    pass
+
+def _engine_options(url: str, is_async: bool = False) -> dict:
+    """
+    Pool and driver options for create_engine/create_async_engine from settings
+    
+    SQLite keeps SQLAlchemy's defaults. On PostgreSQL the statement timeout is
+    sent as a startup option, except in PgBouncer mode where startup options
+    and server-side prepared statements are not usable.
+    """
+    options = {"echo": settings.DB_ECHO}
+    if url.startswith("sqlite"):
+        return options
+    
+    options.update(
+        poolclass=_TimedAsyncQueuePool if is_async else _TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    
+    connect_args = {}
+    timeout_ms = settings.DB_STATEMENT_TIMEOUT_MS
+    if settings.DB_PGBOUNCER:
+        if is_async:
+            connect_args.update(
+                statement_cache_size=0,
+                prepared_statement_cache_size=0,
+                prepared_statement_name_func=lambda: f"__asyncpg_{uuid.uuid4()}__",
+            )
+    elif timeout_ms > 0:
+        if is_async:
+            connect_args["server_settings"] = {"statement_timeout": str(timeout_ms)}
+        else:
+            connect_args["options"] = f"-c statement_timeout={timeout_ms}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+def _apply_transaction_timeout(sync_engine):
+    """PgBouncer mode: scope the statement timeout to each transaction"""
+    timeout_ms = settings.DB_STATEMENT_TIMEOUT_MS
+    if not settings.DB_PGBOUNCER or timeout_ms <= 0 or sync_engine.dialect.name != "postgresql":
+        return
+    
+    @event.listens_for(sync_engine, "begin")
+    def set_local_statement_timeout(conn):
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
 
 # Create database engine
-engine = create_engine(settings.DATABASE_URL, echo=settings.DEBUG)
+engine = create_engine(settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL))
+_apply_transaction_timeout(engine)
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and session factory (only created when DATABASE_ASYNC is enabled)
+async_engine = None
+AsyncSessionLocal = None
+if settings.DATABASE_ASYNC:
+    async_engine = create_async_engine(
+        settings.async_database_url, **_engine_options(settings.async_database_url, is_async=True)
+    )
+    _apply_transaction_timeout(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine, autoflush=False, expire_on_commit=False
+    )
+
+def pool_stats() -> dict:
+    """Connection pool occupancy per engine (QueuePool counters; other pools report their status only)"""
+    engines = {"sync": engine}
+    if async_engine is not None:
+        engines["async"] = async_engine.sync_engine
+    
+    stats = {}
+    for name, current in engines.items():
+        pool = current.pool
+        entry = {"pool": type(pool).__name__, "status": pool.status()}
+        if hasattr(pool, "checkedout"):
+            entry.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                max_overflow=settings.DB_MAX_OVERFLOW,
+                timeout=pool.timeout(),
+            )
+        stats[name] = entry
+    return stats
+
+def _pool_gauge_values() -> dict:
+    return {
+        (name, key): value
+        for name, entry in pool_stats().items()
+        for key, value in entry.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+registry.gauge(
+    "nutriflow_db_pool",
+    "Connection pool size, checked out and overflow connections per engine",
+    ("engine", "stat"),
+    callback=_pool_gauge_values,
+)
+
 # Create base class for models
 Base = declarative_base()
 
@@ -20,13 +150,74 @@ class Subscriber(Base):
     """Subscriber model for email signups"""
     __tablename__ = "subscribers"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Native UUID on PostgreSQL, CHAR(32) elsewhere (SQLite for local runs and benchmarks)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email = Column(String(255), unique=True, nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    source = Column(String(50), default="website", server_default="website")
+    confirmed_at = Column(DateTime, nullable=True)  # double opt-in; NULL while the confirmation link is unused
+    
+    # Keyset pagination order for exports (also serves created_at range filters)
+    __table_args__ = (Index("idx_subscribers_created_at_id", "created_at", "id"),)
     
     def __repr__(self):
         return f"<Subscriber(id={self.id}, email='{self.email}')>"
 
+class Suppression(Base):
+    """Suppressed (unsubscribed) email addresses, looked up by primary key"""
+    __tablename__ = "suppressions"
+    
+    email = Column(String(255), primary_key=True)
+    unsubscribed_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<Suppression(email='{self.email}')>"
+
+class SubscriberRollup(Base):
+    """Hourly signup and unsubscribe counts per source, maintained by analytics.py"""
+    __tablename__ = "subscriber_rollups"
+    
+    bucket = Column(DateTime, primary_key=True)  # start of the hour (UTC)
+    source = Column(String(50), primary_key=True)
+    signups = Column(Integer, nullable=False, default=0)
+    unsubscribes = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<SubscriberRollup(bucket={self.bucket}, source='{self.source}')>"
+
+class EmailOutbox(Base):
+    """Outgoing email, written in the same transaction as its cause and sent by outbox.py"""
+    __tablename__ = "email_outbox"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(50), nullable=False)  # e.g. "confirmation"
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default="pending", server_default="pending")  # pending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    
+    # Due messages are claimed by (status, next_attempt_at); resends are throttled by recipient
+    __table_args__ = (
+        Index("idx_email_outbox_due", "status", "next_attempt_at"),
+        Index("idx_email_outbox_recipient", "recipient"),
+    )
+    
+    def __repr__(self):
+        return f"<EmailOutbox(id={self.id}, kind='{self.kind}', status='{self.status}')>"
+
+class SchemaVersion(Base):
+    """Single-row marker: fingerprint of the schema last created by ensure_schema"""
+    __tablename__ = "schema_version"
+    
+    id = Column(Integer, primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
 # Database dependency
 def get_db():
     """Get database session"""
@@ -36,7 +227,96 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Get async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Session dependency selected by configuration
+get_session = get_async_db if settings.DATABASE_ASYNC else get_db
+
 # Create tables
 def create_tables():
-    """Create all tables in the database"""
+    """Create all tables in the database and add columns missing from older deployments"""
     Base.metadata.create_all(bind=engine)
+    
+    columns = {column["name"] for column in inspect(engine).get_columns("subscribers")}
+    with engine.begin() as conn:
+        if "source" not in columns:
+            conn.execute(text("ALTER TABLE subscribers ADD COLUMN source VARCHAR(50) DEFAULT 'website'"))
+        if "confirmed_at" not in columns:
+            conn.execute(text("ALTER TABLE subscribers ADD COLUMN confirmed_at TIMESTAMP"))
+            # Subscribers collected before double opt-in keep receiving the newsletter
+            conn.execute(text("UPDATE subscribers SET confirmed_at = created_at"))
+        # create_all does not add indexes to an existing table
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_email_outbox_recipient ON email_outbox (recipient)"))
+
+def schema_fingerprint() -> str:
+    """Hash of the DDL of every model, so any model change invalidates the stored marker"""
+    statements = []
+    for table in Base.metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=engine.dialect)))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            statements.append(str(CreateIndex(index).compile(dialect=engine.dialect)))
+    return hashlib.sha256("\n".join(statements).encode()).hexdigest()
+
+def ensure_schema() -> bool:
+    """
+    Create or upgrade the schema unless the stored marker matches the models
+    
+    With DB_SCHEMA_SYNC=marker (default) a matching marker costs one
+    primary-key lookup instead of create_all's per-table reflection;
+    "always" runs create_tables on every boot, "never" leaves the schema to
+    external migrations.
+    
+    Returns:
+        True if DDL was run
+    """
+    mode = settings.DB_SCHEMA_SYNC
+    if mode == "never":
+        return False
+    
+    fingerprint = schema_fingerprint()
+    if mode == "marker":
+        try:
+            with engine.connect() as conn:
+                stored = conn.execute(
+                    select(SchemaVersion.fingerprint).where(SchemaVersion.id == 1)
+                ).scalar()
+            if stored == fingerprint:
+                return False
+        except SQLAlchemyError:
+            pass  # no marker table yet; a database that is down fails again below
+    
+    create_tables()
+    with engine.begin() as conn:
+        conn.execute(delete(SchemaVersion))
+        conn.execute(SchemaVersion.__table__.insert().values(id=1, fingerprint=fingerprint, applied_at=datetime.utcnow()))
+    logger.info("Database schema created/upgraded (fingerprint %s)", fingerprint[:12])
+    return True
+
+def warm_pool(connections: int):
+    """Open pooled connections ahead of traffic so early requests do not pay for connecting"""
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = engine.connect()
+            opened.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            conn.close()  # back to the pool, still open
+
+async def warm_async_pool(connections: int):
+    """Async engine counterpart of warm_pool (no-op unless DATABASE_ASYNC)"""
+    if async_engine is None:
+        return
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = await async_engine.connect()
+            opened.append(conn)
+            await conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            await conn.close()
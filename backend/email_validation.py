@@ -0,0 +1,71 @@
+"""
+Shared email validation pipeline for the request schemas and API handlers
+
+Checks run cheapest first: length and character-class checks, then one
+compiled expression, then a disposable-domain lookup in the blocklist (see blocklist.py).
+"""
+import re
+
+from blocklist import disposable_domains
+
+MIN_LENGTH = 5
+MAX_LENGTH = 254  # RFC 5321 limit
+
+# HTML/SQL injection characters and whitespace are never valid in a signup address
+_FORBIDDEN_CHARS = frozenset("<>'\";\t\r\n ")
+
+# Local part, then a domain of one or more dot-separated labels with at least one dot
+EMAIL_REGEX = re.compile(
+    r"[a-z0-9.!#$%&*+/=?^_`{|}~-]+@[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?(?:\.[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)+"
+)
+
+# Fragments that mark throwaway providers regardless of the exact domain
+BLOCKED_FRAGMENTS = re.compile(r"\.temp\.|\.disposable\.|10minute|mailinator|guerrillamail")
+
+def normalize_email(email: str) -> str:
+    return str(email).strip().lower()
+
+def is_disposable_domain(domain: str) -> bool:
+    """True if the domain or any parent domain is on the disposable list"""
+    return disposable_domains.contains(domain)
+
+def validate_email(email: str, check_domain: bool = True) -> str:
+    """
+    Validate an email address and return it normalized
+    
+    Args:
+        email: Raw email address
+        check_domain: Also reject disposable domains (off for unsubscribes)
+        
+    Returns:
+        Normalized (stripped, lowercased) email
+        
+    Raises:
+        ValueError: If the email is invalid or its domain is not allowed
+    """
+    email = normalize_email(email)
+    
+    # Cheap structural checks first
+    if not MIN_LENGTH <= len(email) <= MAX_LENGTH:
+        raise ValueError("Invalid email format")
+    if email.count("@") != 1 or not _FORBIDDEN_CHARS.isdisjoint(email):
+        raise ValueError("Invalid email format")
+    if ".." in email or email[0] == "." or email[-1] == ".":
+        raise ValueError("Invalid email format")
+    
+    if not EMAIL_REGEX.fullmatch(email):
+        raise ValueError("Invalid email format")
+    
+    if check_domain:
+        if is_disposable_domain(email.rpartition("@")[2]) or BLOCKED_FRAGMENTS.search(email):
+            raise ValueError("Email domain not allowed")
+    
+    return email
+
+def is_valid_email(email: str, check_domain: bool = True) -> bool:
+    """Boolean form of validate_email"""
+    try:
+        validate_email(email, check_domain)
+    except ValueError:
+        return False
+    return True
@@ -5,12 +5,48 @@
 CREATE TABLE IF NOT EXISTS subscribers (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     email VARCHAR(255) UNIQUE NOT NULL,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP NOT NULL
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    source VARCHAR(50) DEFAULT 'website',
+    confirmed_at TIMESTAMP WITH TIME ZONE  -- double opt-in, NULL until confirmed
 );
 
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_subscribers_email ON subscribers(email);
-CREATE INDEX IF NOT EXISTS idx_subscribers_created_at ON subscribers(created_at);
+-- (created_at, id) also serves keyset pagination for exports
+CREATE INDEX IF NOT EXISTS idx_subscribers_created_at_id ON subscribers(created_at, id);
+
+-- Suppression list (unsubscribed emails), primary key gives an indexed lookup
+CREATE TABLE IF NOT EXISTS suppressions (
+    email VARCHAR(255) PRIMARY KEY,
+    unsubscribed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_suppressions_unsubscribed_at ON suppressions(unsubscribed_at);
+
+-- Hourly signup/unsubscribe rollups per source, refreshed incrementally by analytics.py
+CREATE TABLE IF NOT EXISTS subscriber_rollups (
+    bucket TIMESTAMP NOT NULL,
+    source VARCHAR(50) NOT NULL,
+    signups INTEGER NOT NULL DEFAULT 0,
+    unsubscribes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, source)
+);
+
+-- Outgoing email (double opt-in confirmations), drained by outbox.py
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    recipient VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    created_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    sent_at TIMESTAMP,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_recipient ON email_outbox(recipient);
 
 -- Add email format constraint
 ALTER TABLE subscribers 
@@ -18,10 +54,10 @@ ADD CONSTRAINT chk_email_format
 CHECK (email ~* '^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$');
 
 -- Insert some sample data for testing (optional)
-INSERT INTO subscribers (email) VALUES 
-  ('test@example.com'),
-  ('demo@nutriflow.fr'),
-  ('sample@dietitian.com')
+INSERT INTO subscribers (email, confirmed_at) VALUES 
+  ('test@example.com', CURRENT_TIMESTAMP),
+  ('demo@nutriflow.fr', CURRENT_TIMESTAMP),
+  ('sample@dietitian.com', CURRENT_TIMESTAMP)
 ON CONFLICT (email) DO NOTHING;
 
 -- Grant necessary permissions
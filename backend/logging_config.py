@@ -0,0 +1,139 @@
+"""
+Logging setup: structured records written off the event loop
+
+Handlers attached to the root logger only enqueue records; a QueueListener
+thread formats them and writes to stdout, so a slow terminal or log collector
+never stalls request handling. Messages use lazy %-style arguments, which are
+only interpolated by the listener thread, and identical messages above a
+per-interval burst (health checks, rate limit warnings under attack) are
+dropped before they are queued.
+"""
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+from config import settings
+
+# Attributes every LogRecord has; anything else was passed through ``extra=``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per line, including any ``extra=`` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(",", ":"), ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through at most ``burst`` records per message template and interval
+
+    Records are keyed by logger, level and the unformatted message, so lazy
+    %-style calls with varying arguments count as the same message. ERROR and
+    above always pass. The first record after a throttled interval carries a
+    ``suppressed`` field with the number of records dropped.
+    """
+
+    def __init__(self, burst: int, interval: float, max_keys: int = 1024):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_keys = max_keys
+        self._windows: Dict[Tuple[str, int, str], list] = {}  # key -> [window_start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is None and len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread
+
+    The stock ``prepare`` interpolates the message on the caller's thread; the
+    queue never leaves this process, so the record can be passed through as is.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+_listener: Optional[QueueListener] = None
+
+def _log_level() -> int:
+    if settings.LOG_LEVEL:
+        return logging.getLevelName(settings.LOG_LEVEL.upper())
+    return logging.INFO if settings.DEBUG else logging.WARNING
+
+def setup_logging() -> Optional[QueueListener]:
+    """
+    Configure the root logger from settings (idempotent)
+
+    Returns:
+        The running QueueListener, or None when LOG_ASYNC is off
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if settings.LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    if settings.LOG_ASYNC:
+        handler = _DeferredQueueHandler(queue.SimpleQueue())
+        _listener = QueueListener(handler.queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = stream_handler
+    handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_BURST, settings.LOG_SAMPLE_INTERVAL))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(_log_level())
+    return _listener
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
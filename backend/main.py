@@ -1,24 +1,28 @@
+# First import: startup phases are timed from here (see startup.py)
+from startup import startup_tracker
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
+import asyncio
 import logging
-import sys
 
 from config import settings
-from database import create_tables
-from api import router
-from security import rate_limit_middleware, security_headers_middleware
-
-# Configure logging
-log_level = logging.INFO if settings.DEBUG else logging.WARNING
-logging.basicConfig(
-    level=log_level,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-    ] if settings.is_production else [logging.StreamHandler()]
-)
+from logging_config import setup_logging, shutdown_logging
+from database import ensure_schema, warm_pool, warm_async_pool
+from membership import membership_filter
+from metrics import registry, run_loop_lag_monitor, run_snapshot_writer, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from blocklist import disposable_domains
+from write_behind import write_behind
+from outbox import outbox_dispatcher
+from analytics import signup_analytics
+from api import router, verify_admin_key
+from security import RateLimitMiddleware, SecurityHeadersMiddleware, get_client_ip, is_allowed_scraper
+from responses import PrecomputedJSON
+
+# Configure logging (records are written by a background thread, see logging_config)
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
@@ -31,8 +35,20 @@ app = FastAPI(
     redoc_url=settings.redoc_url,
     # Hide server info in production
     openapi_url="/openapi.json" if not settings.is_production else None,
+    # orjson-encoded JSON for every endpoint that does not pick its own response class
+    default_response_class=ORJSONResponse,
 )
 
+# Constant bodies, serialized once
+ROOT_RESPONSE = PrecomputedJSON({"message": "NutriFlow API", "version": settings.VERSION, "status": "running"})
+HEALTH_RESPONSE = PrecomputedJSON({"status": "healthy", "message": "API is running"})
+READY_RESPONSE = PrecomputedJSON({"status": "ready"})
+STARTING_RESPONSE = PrecomputedJSON({"status": "starting"}, status_code=503)
+
+# Retry delays for the background database warm-up while the database is unreachable
+WARM_UP_RETRY_INITIAL = 1.0
+WARM_UP_RETRY_MAX = 30.0
+
 # Add security middlewares (order matters!)
 if settings.is_production:
     # Trusted host middleware for production
@@ -41,8 +57,8 @@ if settings.is_production:
         allowed_hosts=["*.nutri-flow.me", "nutri-flow.me", "localhost"]
     )
 
-app.middleware("http")(security_headers_middleware)
-app.middleware("http")(rate_limit_middleware)
+app.add_middleware(SecurityHeadersMiddleware)
+app.add_middleware(RateLimitMiddleware)
 
 # Add CORS middleware with restrictive settings
 app.add_middleware(
@@ -50,7 +66,7 @@ app.add_middleware(
     allow_origins=settings.ALLOWED_ORIGINS,
     allow_credentials=False,  # Security: Keep false unless needed
     allow_methods=["GET", "POST", "OPTIONS"],  # Only needed methods
-    allow_headers=["Content-Type", "Accept", "Origin", "User-Agent", "X-Requested-With"],
+    allow_headers=["Content-Type", "Accept", "Origin", "User-Agent", "X-Requested-With", "Idempotency-Key"],
     expose_headers=["X-Request-ID"],  # For request tracking
 )
 
@@ -62,7 +78,7 @@ app.include_router(router, prefix=settings.API_PREFIX)
 async def global_exception_handler(request: Request, exc: Exception):
     """Global exception handler to prevent information leakage"""
     if settings.is_production:
-        logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
+        logger.error("Unhandled exception: %s", exc, exc_info=True)
         return JSONResponse(
             status_code=500,
             content={"detail": "Internal server error"}
@@ -71,43 +87,117 @@ async def global_exception_handler(request: Request, exc: Exception):
         # In development, show detailed errors
         raise exc
 
+startup_tracker.mark("app_created")
+
+async def warm_up():
+    """
+    Check the schema, warm the connection pool and start the database-backed background tasks
+    
+    Runs after startup so the process serves /health without waiting on the
+    database; /ready answers 503 until this completes. Retries with backoff
+    while the database is unreachable.
+    """
+    delay = WARM_UP_RETRY_INITIAL
+    while True:
+        try:
+            if await asyncio.to_thread(ensure_schema):
+                logger.info("Database tables created/verified")
+            if settings.DB_POOL_WARMUP:
+                connections = min(settings.DB_POOL_WARMUP, settings.DB_POOL_SIZE)
+                await asyncio.to_thread(warm_pool, connections)
+                await warm_async_pool(connections)
+            # Replays spilled subscriptions, so it needs the schema; until then
+            # /subscribe writes directly
+            await write_behind.start()
+            break
+        except Exception as e:
+            logger.warning("Database not ready (%s), retrying in %.1fs", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARM_UP_RETRY_MAX)
+    
+    startup_tracker.mark("ready")
+    
+    await outbox_dispatcher.start()
+    
+    if membership_filter.enabled:
+        # Built in the background; lookups fall through to the database until ready
+        app.state.membership_filter_task = asyncio.create_task(membership_filter.run_periodic_rebuild())
+    
+    if signup_analytics.enabled:
+        app.state.analytics_task = asyncio.create_task(signup_analytics.run_periodic_refresh())
+
 @app.on_event("startup")
 async def startup_event():
-    """Create database tables on startup"""
-    logger.info(f"Starting NutriFlow API v{settings.VERSION}...")
-    logger.info(f"Environment: {settings.ENVIRONMENT}")
-    logger.info(f"Debug mode: {settings.DEBUG}")
-    create_tables()
-    logger.info("Database tables created/verified")
+    """Start background services; the database is checked in the background (see warm_up)"""
+    logger.info("Starting NutriFlow API v%s...", settings.VERSION)
+    logger.info("Environment: %s", settings.ENVIRONMENT)
+    logger.info("Debug mode: %s", settings.DEBUG)
+    if settings.DOUBLE_OPT_IN_REQUESTED and not settings.DOUBLE_OPT_IN_ENABLED:
+        logger.warning("DOUBLE_OPT_IN_ENABLED ignored: SMTP_HOST is not set, signups are confirmed immediately")
+    
+    disposable_domains.install_sighup_handler(asyncio.get_running_loop())
+    
+    app.state.warm_up_task = asyncio.create_task(warm_up())
+    
+    if settings.METRICS_ENABLED:
+        app.state.loop_lag_task = asyncio.create_task(run_loop_lag_monitor())
+        if settings.METRICS_MULTIPROC_DIR:
+            app.state.metrics_snapshot_task = asyncio.create_task(run_snapshot_writer())
+    
+    startup_tracker.mark("app_startup")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Drain queued subscriptions and flush pending log records before the process exits"""
+    logger.info("Shutting down NutriFlow API")
+    app.state.warm_up_task.cancel()
+    await write_behind.stop()
+    await outbox_dispatcher.stop(timeout=5.0)
+    if settings.METRICS_ENABLED and settings.METRICS_MULTIPROC_DIR:
+        # Final values, folded into the archive by the gunicorn master once this worker exits
+        registry.write_snapshot()
+    shutdown_logging()
 
 @app.get("/")
 async def root(request: Request):
     """Root endpoint with minimal information"""
-    from security import get_client_ip
     client_ip = get_client_ip(request)
-    logger.info(f"Root endpoint accessed from {client_ip} - Headers: {dict(request.headers)}")
+    logger.info("Root endpoint accessed from %s", client_ip)
+    if settings.LOG_HEADERS:
+        logger.debug("Root endpoint headers: %s", dict(request.headers))
     
-    return {
-        "message": "NutriFlow API",
-        "version": settings.VERSION,
-        "status": "running"
-    }
+    return ROOT_RESPONSE()
 
 @app.get("/health")
 async def health_check(request: Request):
     """Health check endpoint for monitoring"""
-    from security import get_client_ip
     client_ip = get_client_ip(request)
-    logger.info(f"Health check from {client_ip} - Headers: {dict(request.headers)}")
+    logger.info("Health check from %s", client_ip)
+    if settings.LOG_HEADERS:
+        logger.debug("Health check headers: %s", dict(request.headers))
     
-    return {"status": "healthy", "message": "API is running"}
+    return HEALTH_RESPONSE()
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the schema is checked and the connection pool warmed"""
+    return READY_RESPONSE() if startup_tracker.ready else STARTING_RESPONSE()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request, admin_key: str = None):
+    """Prometheus scrape endpoint (admin key, or a scraper from METRICS_ALLOWED_NETWORKS)"""
+    if not settings.METRICS_ENABLED:
+        return PlainTextResponse("Metrics disabled\n", status_code=404)
+    if not is_allowed_scraper(request.scope):
+        verify_admin_key(request, admin_key)
+    return PlainTextResponse(registry.render(), media_type=METRICS_CONTENT_TYPE)
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=settings.DEBUG and not settings.is_production,
-        access_log=settings.DEBUG
-    )
+    if settings.DEBUG and not settings.is_production:
+        # Development: one process with auto-reload
+        import uvicorn
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, access_log=True)
+    else:
+        # Production: multi-worker server configured from settings (see serve.py)
+        from serve import main as serve
+        serve()
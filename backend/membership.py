@@ -0,0 +1,185 @@
+"""
+In-process Bloom filter for suppressed emails
+
+Its only reader is the "already unsubscribed?" check of /api/unsubscribe
+(is_email_unsubscribed): a negative answer is definite, so for an address
+that was never unsubscribed that check skips one primary-key lookup on the
+suppressions table. Nothing else consults it; in particular signups do not
+check suppressions. unsubscribe_email still runs its own authoritative
+SELECT and INSERT, so a positive or stale answer only costs that lookup.
+
+The filter is per process (suppressions written by other workers show up
+after the next rebuild) and costs a rebuild task plus about 1.2 bytes per
+capacity entry. That trade only pays off when /api/unsubscribe sees heavy
+traffic, which is why it is off by default (MEMBERSHIP_FILTER_ENABLED).
+
+Subscribers are not filtered: signups upsert unconditionally and subscriber
+lookups only follow a conflict, so a negative answer would never save a query.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, func
+
+from config import settings
+from database import SessionLocal, Suppression
+
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing of one blake2b digest"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(64, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def add(self, item: str):
+        """Add an item to the filter"""
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+    def false_positive_rate(self) -> float:
+        """Expected false-positive rate for the current number of items"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def stats(self) -> Dict:
+        return {
+            "items": self.count,
+            "capacity": self.capacity,
+            "bits": self.num_bits,
+            "hashes": self.num_hashes,
+            "memory_bytes": self.memory_bytes,
+            "false_positive_rate": round(self.false_positive_rate(), 6),
+        }
+
+class EmailMembershipFilter:
+    """
+    Bloom filter of suppressed emails, built from the database
+
+    Until the first build completes (or when disabled) every check answers
+    "maybe", so callers always fall back to the database.
+    """
+
+    def __init__(self):
+        self.enabled = settings.MEMBERSHIP_FILTER_ENABLED
+        self.suppressions: Optional[BloomFilter] = None
+        self.built_at: Optional[float] = None
+        self.build_duration: Optional[float] = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._pending: List[str] = []  # suppressions seen while a rebuild is running
+
+    def might_be_suppressed(self, email: str) -> bool:
+        """False only if the email is definitely not suppressed"""
+        suppressions = self.suppressions
+        return suppressions is None or email in suppressions
+
+    def add_suppression(self, email: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._rebuilding:
+                self._pending.append(email)
+            if self.suppressions is not None:
+                self.suppressions.add(email)
+
+    def _build_filter(self, db, model) -> BloomFilter:
+        """Stream every email of a table into a new filter sized for its row count"""
+        total = db.execute(select(func.count()).select_from(model)).scalar_one()
+        capacity = max(settings.MEMBERSHIP_FILTER_CAPACITY, total * 2)
+        bloom = BloomFilter(capacity, settings.MEMBERSHIP_FILTER_ERROR_RATE)
+
+        result = db.execute(select(model.email).execution_options(yield_per=10000))
+        for email in result.scalars():
+            bloom.add(email)
+        return bloom
+
+    def rebuild(self):
+        """Rebuild the filter from the database and swap it in atomically"""
+        if not self.enabled:
+            return
+
+        started = time.time()
+        with self._lock:
+            self._rebuilding = True
+            self._pending = []
+
+        db = SessionLocal()
+        try:
+            suppressions = self._build_filter(db, Suppression)
+        except Exception as e:
+            logger.error("Membership filter rebuild failed: %s", e)
+            with self._lock:
+                self._rebuilding = False
+                self._pending = []
+            return
+        finally:
+            db.close()
+
+        with self._lock:
+            # Replay writes that raced with the table scan
+            for email in self._pending:
+                suppressions.add(email)
+            self.suppressions = suppressions
+            self._rebuilding = False
+            self._pending = []
+
+        self.built_at = time.time()
+        self.build_duration = self.built_at - started
+        logger.info(
+            "Membership filter rebuilt in %.2fms: %d suppressions",
+            self.build_duration * 1000, suppressions.count
+        )
+
+    async def rebuild_async(self):
+        """Rebuild in a worker thread so the event loop keeps serving requests"""
+        await asyncio.to_thread(self.rebuild)
+
+    async def run_periodic_rebuild(self):
+        """Background task: build at startup, then refresh every rebuild interval"""
+        interval = settings.MEMBERSHIP_FILTER_REBUILD_INTERVAL
+        while True:
+            await self.rebuild_async()
+            if interval <= 0:
+                return
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "built_at": self.built_at,
+            "build_duration_ms": round(self.build_duration * 1000, 2) if self.build_duration else None,
+            "suppressions": self.suppressions.stats() if self.suppressions else None,
+        }
+
+# Global membership filter instance
+membership_filter = EmailMembershipFilter()
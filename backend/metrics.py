@@ -0,0 +1,358 @@
+"""
+In-process metrics exposed in the Prometheus text format at /metrics
+
+Collection is meant to stay on in production: an observation is a bucket
+search plus a few list increments, with no locks. Requests are handled on the
+event loop thread, so updates from handlers never race; updates from worker
+threads may in rare cases lose an increment, which is acceptable for metrics.
+
+Under gunicorn every worker has its own registry and a scrape reaches one
+of them. With METRICS_MULTIPROC_DIR set (serve.py creates one when it starts
+more than one worker) each worker writes a snapshot of its metrics to
+``<pid>.json`` in that directory every METRICS_MULTIPROC_INTERVAL seconds
+and at shutdown, and /metrics merges its live values with the other
+workers' snapshots: counters and histograms are summed, gauges get a
+``worker`` label. Counters of exited workers are folded into
+``archive.json`` by the gunicorn master (see archive_worker_snapshot), so
+totals do not drop when a worker is recycled.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds; tuned for API calls in the sub-millisecond to multi-second range
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # charset is appended by PlainTextResponse
+
+ARCHIVE_SNAPSHOT = "archive.json"
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter, optionally labelled"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        return dict(self._values)
+
+    def samples(self, values: Optional[Dict] = None) -> Iterable[str]:
+        for labels, value in (self._values if values is None else values).items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+class Gauge:
+    """
+    Point-in-time value, either set directly or read from a callback at scrape time
+
+    A callback returns a number, or for labelled gauges a mapping of label
+    tuples to numbers.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        if self.callback is None:
+            return dict(self._values)
+        try:
+            result = self.callback()
+        except Exception as e:
+            logger.warning("Metric callback for %s failed: %s", self.name, e)
+            return {}
+        return result if isinstance(result, dict) else {(): result}
+
+    def samples(self, values: Optional[Dict] = None, labelnames: Optional[Sequence[str]] = None) -> Iterable[str]:
+        labelnames = self.labelnames if labelnames is None else labelnames
+        for labels, value in (self.collect() if values is None else values).items():
+            if value is not None:
+                yield f"{self.name}{_format_labels(labelnames, labels)} {_format_value(value)}"
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally labelled"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (last one is +Inf)..., sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Observe the duration of the enclosed block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def collect(self) -> Dict[Tuple[str, ...], List[float]]:
+        return {labels: list(series) for labels, series in list(self._series.items())}
+
+    def samples(self, series_by_labels: Optional[Dict] = None) -> Iterable[str]:
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        if series_by_labels is None:
+            series_by_labels = self._series
+        for labels, series in list(series_by_labels.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                label_text = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{label_text} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(series[-1])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+class MetricsRegistry:
+    """Ordered collection of metrics rendered together at scrape time"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              callback: Optional[Callable] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict:
+        """Current values of every metric, JSON-serializable (see write_snapshot)"""
+        return {
+            name: {
+                "type": metric.type_name,
+                "values": [[list(labels), value] for labels, value in metric.collect().items()],
+            }
+            for name, metric in self._metrics.items()
+        }
+
+    def write_snapshot(self):
+        """Publish this worker's values to METRICS_MULTIPROC_DIR for the other workers' scrapes"""
+        directory = settings.METRICS_MULTIPROC_DIR
+        if not directory:
+            return
+        _write_json(os.path.join(directory, f"{os.getpid()}.json"), self.snapshot())
+
+    def _other_snapshots(self) -> Dict[str, Dict]:
+        """Snapshots of the other workers (and the archive of exited ones), by file stem"""
+        directory = settings.METRICS_MULTIPROC_DIR
+        own = f"{os.getpid()}.json"
+        snapshots = {}
+        try:
+            filenames = os.listdir(directory)
+        except OSError as e:
+            logger.warning("Metrics directory %s unreadable: %s", directory, e)
+            return snapshots
+        for filename in filenames:
+            if not filename.endswith(".json") or filename == own:
+                continue
+            snapshot = _read_json(os.path.join(directory, filename))
+            if snapshot is not None:
+                snapshots[filename[:-len(".json")]] = snapshot
+        return snapshots
+
+    def _merged_samples(self, metric, others: Dict[str, Dict]) -> Iterable[str]:
+        """Samples of metric with this worker's live values merged with the other snapshots"""
+        if metric.type_name == "gauge":
+            pid = str(os.getpid())
+            values = {labels + (pid,): value for labels, value in metric.collect().items()}
+            for worker, snapshot in others.items():
+                for labels, value in snapshot.get(metric.name, {}).get("values", ()):
+                    values[tuple(labels) + (worker,)] = value
+            return metric.samples(values, metric.labelnames + ("worker",))
+
+        values = metric.collect()
+        for snapshot in others.values():
+            _merge_values(values, snapshot.get(metric.name, {}).get("values", ()))
+        return metric.samples(values)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        others = self._other_snapshots() if settings.METRICS_MULTIPROC_DIR else None
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples() if others is None else self._merged_samples(metric, others))
+        return "\n".join(lines) + "\n"
+
+def _merge_values(values: Dict, entries: Iterable):
+    """Add snapshot [labels, value] entries (numbers or histogram series) into values"""
+    for labels, value in entries:
+        labels = tuple(labels)
+        current = values.get(labels)
+        if current is None:
+            values[labels] = value
+        elif isinstance(value, list):
+            values[labels] = [a + b for a, b in zip(current, value)]
+        else:
+            values[labels] = current + value
+
+def _write_json(path: str, data: Dict):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+    os.replace(temporary, path)  # readers never see a partial file
+
+def _read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # removed or archived since listdir
+
+def prepare_multiproc_dir(directory: str):
+    """Create directory and remove snapshots left by a previous server run"""
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        if filename.endswith(".json") or filename.endswith(".tmp"):
+            os.remove(os.path.join(directory, filename))
+
+def archive_worker_snapshot(directory: str, pid: int):
+    """
+    Fold an exited worker's counters and histograms into archive.json
+
+    Called by the gunicorn master, the only writer of the archive. Gauges
+    describe a live process and are dropped.
+    """
+    path = os.path.join(directory, f"{pid}.json")
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+    archive_path = os.path.join(directory, ARCHIVE_SNAPSHOT)
+    archive = _read_json(archive_path) or {}
+    for name, metric in snapshot.items():
+        if metric["type"] == "gauge":
+            continue
+        entry = archive.setdefault(name, {"type": metric["type"], "values": []})
+        values = {tuple(labels): value for labels, value in entry["values"]}
+        _merge_values(values, metric["values"])
+        entry["values"] = [[list(labels), value] for labels, value in values.items()]
+    _write_json(archive_path, archive)
+    os.remove(path)
+
+# Global registry and the application's metrics
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "nutriflow_http_request_duration_seconds",
+    "HTTP request latency by route template, method and status code",
+    ("route", "method", "status"),
+)
+subscribe_stage_duration = registry.histogram(
+    "nutriflow_subscribe_stage_duration_seconds",
+    "Time spent in each stage of POST /api/subscribe",
+    ("stage",),
+)
+db_checkout_duration = registry.histogram(
+    "nutriflow_db_pool_checkout_seconds",
+    "Time to obtain a connection from the database pool (waiting and connecting)",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+event_loop_lag = registry.histogram(
+    "nutriflow_event_loop_lag_seconds",
+    "Delay between a scheduled event loop wakeup and when it actually ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+event_loop_lag_last = registry.gauge(
+    "nutriflow_event_loop_lag_last_seconds",
+    "Most recent event loop lag sample",
+)
+
+def _rate_limiter_stats() -> Dict[Tuple[str, ...], float]:
+    from security import rate_limiter
+    return {
+        (key,): value
+        for key, value in rate_limiter.stats().items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+registry.gauge(
+    "nutriflow_rate_limiter",
+    "Rate limiter table size, capacity, evictions and block counts",
+    ("stat",),
+    callback=_rate_limiter_stats,
+)
+
+async def run_snapshot_writer(interval: float = None):
+    """Background task: publish this worker's metrics every interval (multi-worker servers)"""
+    interval = interval or settings.METRICS_MULTIPROC_INTERVAL
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(registry.write_snapshot)
+        except OSError as e:
+            logger.warning("Could not write metrics snapshot: %s", e)
+
+async def run_loop_lag_monitor(interval: float = None):
+    """Background task: sample how late the event loop runs a timer that should fire every interval"""
+    interval = interval or settings.METRICS_LOOP_LAG_INTERVAL
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - scheduled)
+        event_loop_lag.observe(lag)
+        event_loop_lag_last.set(lag)
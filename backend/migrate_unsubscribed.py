@@ -0,0 +1,69 @@
+"""
+One-time migration of the legacy unsubscribed_emails.json list into the suppressions table
+
+Usage:
+    python migrate_unsubscribed.py [path/to/unsubscribed_emails.json]
+
+Safe to run more than once: existing suppressions are left untouched.
+"""
+import json
+import logging
+import sys
+from pathlib import Path
+
+from database import SessionLocal, Suppression, create_tables
+from services import _dialect_insert
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+def load_legacy_emails(path: Path) -> list:
+    """Read and normalize the emails stored in the legacy JSON file"""
+    if not path.exists():
+        return []
+
+    with open(path, 'r') as f:
+        data = json.load(f)
+
+    emails = {str(email).lower().strip() for email in data if str(email).strip()}
+    return sorted(emails)
+
+def migrate(path: Path) -> int:
+    """
+    Import the legacy unsubscribe list into the suppressions table
+
+    Args:
+        path: Path to the legacy JSON file
+
+    Returns:
+        Number of emails read from the file
+    """
+    emails = load_legacy_emails(path)
+    if not emails:
+        logger.info("No legacy unsubscribed emails found in %s", path)
+        return 0
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        stmt = _dialect_insert(db.get_bind().dialect.name, Suppression)
+        stmt = stmt.on_conflict_do_nothing(index_elements=[Suppression.email])
+        for start in range(0, len(emails), BATCH_SIZE):
+            batch = emails[start:start + BATCH_SIZE]
+            db.execute(stmt, [{"email": email} for email in batch])
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    logger.info("Imported %s legacy unsubscribed emails from %s", len(emails), path)
+    return len(emails)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    source = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("unsubscribed_emails.json")
+    count = migrate(source)
+    print(f"Migrated {count} emails into suppressions")
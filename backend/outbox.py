@@ -0,0 +1,346 @@
+"""
+Outgoing email dispatcher for the email_outbox table
+
+Requests never talk to SMTP: they insert outbox rows in their own transaction
+(see confirmation.confirmation_outbox_insert) and return. OutboxDispatcher, a
+background task started once the schema is ready, drains the table:
+
+- claims up to OUTBOX_BATCH_SIZE due messages with one UPDATE ... RETURNING
+  that pushes their next_attempt_at OUTBOX_LEASE seconds ahead (rows are
+  picked with FOR UPDATE SKIP LOCKED on PostgreSQL), so several workers can
+  drain the same table without sending a message twice
+- sends the batch over one SMTP connection, which is kept open between
+  batches and closed after SMTP_IDLE_TIMEOUT seconds without mail
+- marks sent messages, and reschedules failed ones with exponential backoff
+  (OUTBOX_RETRY_BASE doubled per attempt, capped at OUTBOX_RETRY_MAX) until
+  OUTBOX_MAX_ATTEMPTS; permanent SMTP rejections (5xx) fail at once
+- when the server cannot be reached or rejects the greeting, STARTTLS or the
+  login, defers the unsent messages with the same backoff (counted per
+  consecutive connection failure) without using up their attempts: a
+  misconfigured or unreachable server never fails a message
+
+Delivery is at least once: a worker that dies between sending and recording
+leaves the message to be retried when its lease expires. The table is polled
+every OUTBOX_POLL_INTERVAL seconds; notify() wakes the dispatcher at once for
+messages created by this process. Dispatch is off while SMTP_HOST is empty;
+messages then wait in the table.
+"""
+import asyncio
+import logging
+import smtplib
+import ssl
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import make_msgid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+
+from config import settings
+from database import EmailOutbox, SessionLocal
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+dispatched_messages = registry.counter(
+    "nutriflow_outbox_messages_total",
+    "Outbox messages by dispatch outcome (sent, retry, deferred, failed)",
+    ("outcome",),
+)
+
+class _ConnectFailed(Exception):
+    """The SMTP connection could not be opened, secured or authenticated"""
+
+class OutboxDispatcher:
+    """Background sender for email_outbox rows, with batching, SMTP connection reuse and retry"""
+
+    def __init__(self):
+        self.enabled = bool(settings.SMTP_HOST)
+        self.batch_size = settings.OUTBOX_BATCH_SIZE
+        self.poll_interval = settings.OUTBOX_POLL_INTERVAL
+        self.max_attempts = settings.OUTBOX_MAX_ATTEMPTS
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_used_at = 0.0
+        self._stopping = False
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.connections = 0
+        self.deferred = 0
+        self._connect_failures = 0  # consecutive; drives the deferral backoff
+        self.last_error: Optional[str] = None
+
+    def notify(self):
+        """Wake the dispatcher now (messages were just committed); safe from any thread"""
+        if self._task is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info("Outbox dispatcher started (SMTP %s:%d)", settings.SMTP_HOST, settings.SMTP_PORT)
+
+    async def stop(self, timeout: float = 10.0):
+        """Let the batch being sent finish (up to timeout), then close the SMTP connection"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        self._stopping = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(task, timeout)
+        except asyncio.TimeoutError:
+            # Unrecorded messages are sent again once their lease expires
+            logger.error("Outbox batch still sending after %ss", timeout)
+        await asyncio.to_thread(self._close_smtp)
+
+    async def _run(self):
+        wake = self._wake
+        while not self._stopping:
+            try:
+                claimed = await asyncio.to_thread(self.dispatch_batch)
+            except Exception as e:
+                logger.error("Outbox dispatch failed: %s", e)
+                claimed = 0
+            if claimed >= self.batch_size or self._stopping:
+                continue  # more may be due
+            try:
+                await asyncio.wait_for(wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+
+    def dispatch_batch(self) -> int:
+        """
+        Claim, send and record one batch of due messages (blocking, run in a thread)
+
+        Returns:
+            Number of messages claimed
+        """
+        messages = self._claim()
+        if not messages:
+            self._close_idle_smtp()
+            return 0
+
+        results: List[Tuple[int, int, Optional[str], bool]] = []  # id, attempts, error, permanent
+        try:
+            for index, message in enumerate(messages):
+                error, permanent = self._send(message)
+                results.append((message.id, message.attempts, error, permanent))
+                if error is not None and self._smtp is None:
+                    # No usable connection: retry the rest later instead of reconnecting for each
+                    results.extend((other.id, other.attempts, error, False) for other in messages[index + 1:])
+                    break
+        except _ConnectFailed as e:
+            # Server-side problem, not the messages': defer what was not sent
+            self._defer(messages[len(results):], str(e))
+        self._record(results)
+        self.batches += 1
+        return len(messages)
+
+    def _claim(self) -> List:
+        now = datetime.utcnow()
+        due = (
+            select(EmailOutbox.id)
+            .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.next_attempt_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(EmailOutbox)
+            # Repeat the due condition: on SQLite a concurrent claimer may have committed first
+            .where(EmailOutbox.id.in_(due), EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+            .values(
+                next_attempt_at=now + timedelta(seconds=settings.OUTBOX_LEASE),
+                attempts=EmailOutbox.attempts + 1,
+            )
+            .returning(EmailOutbox.id, EmailOutbox.recipient, EmailOutbox.subject, EmailOutbox.body, EmailOutbox.attempts)
+        )
+        db = SessionLocal()
+        try:
+            messages = db.execute(stmt).all()
+            db.commit()
+            return messages
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _send(self, message) -> Tuple[Optional[str], bool]:
+        """Send one message; returns (error, permanent), error None on success"""
+        email = EmailMessage()
+        email["From"] = settings.MAIL_FROM
+        email["To"] = message.recipient
+        email["Subject"] = message.subject
+        email["Message-ID"] = make_msgid(domain=settings.MAIL_FROM.rpartition("@")[2].strip("> ") or None)
+        email.set_content(message.body)
+
+        for attempt in range(2):
+            smtp = self._connection()  # _ConnectFailed propagates to dispatch_batch
+            try:
+                smtp.send_message(email)
+                self._smtp_used_at = time.monotonic()
+                return None, False
+            except smtplib.SMTPServerDisconnected as e:
+                # The reused connection was closed by the server: reconnect once
+                self._close_smtp()
+                if attempt:
+                    return f"disconnected: {e}", False
+            except smtplib.SMTPRecipientsRefused as e:
+                codes = [code for code, _ in e.recipients.values()]
+                return f"recipient refused: {e.recipients}", all(500 <= code < 600 for code in codes)
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code == 421:  # service closing: the connection is unusable
+                    self._close_smtp()
+                return f"{e.smtp_code} {e.smtp_error!r}", 500 <= e.smtp_code < 600
+            except (smtplib.SMTPException, OSError) as e:
+                self._close_smtp()
+                return f"{type(e).__name__}: {e}", False
+        return "disconnected", False
+
+    def _defer(self, messages: List, error: str):
+        """Reschedule messages after a connection failure, giving back the attempt the claim took"""
+        self._connect_failures += 1
+        delay = min(settings.OUTBOX_RETRY_BASE * 2 ** (self._connect_failures - 1), settings.OUTBOX_RETRY_MAX)
+        logger.error("SMTP connection failed (%s), %d messages deferred by %.0fs", error, len(messages), delay)
+        self.last_error = error
+        if not messages:
+            return
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id.in_([message.id for message in messages]))
+                .values(
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+                    attempts=EmailOutbox.attempts - 1,
+                    last_error=error,
+                )
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.deferred += len(messages)
+        dispatched_messages.inc("deferred", amount=len(messages))
+
+    def _record(self, results: List[Tuple[int, int, Optional[str], bool]]):
+        now = datetime.utcnow()
+        sent_ids = [message_id for message_id, _, error, _ in results if error is None]
+        db = SessionLocal()
+        try:
+            if sent_ids:
+                db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id.in_(sent_ids))
+                    .values(status="sent", sent_at=now, last_error=None)
+                )
+            for message_id, attempts, error, permanent in results:
+                if error is None:
+                    continue
+                if permanent or attempts >= self.max_attempts:
+                    values = {"status": "failed", "last_error": error}
+                    self.failed += 1
+                    dispatched_messages.inc("failed")
+                    logger.error("Outbox message %d failed after %d attempts: %s", message_id, attempts, error)
+                else:
+                    delay = min(settings.OUTBOX_RETRY_BASE * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX)
+                    values = {"next_attempt_at": now + timedelta(seconds=delay), "last_error": error}
+                    self.retried += 1
+                    dispatched_messages.inc("retry")
+                    logger.warning("Outbox message %d not sent (%s), retrying in %.0fs", message_id, error, delay)
+                self.last_error = error
+                db.execute(update(EmailOutbox).where(EmailOutbox.id == message_id).values(**values))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.sent += len(sent_ids)
+        dispatched_messages.inc("sent", amount=len(sent_ids))
+
+    def _connection(self) -> smtplib.SMTP:
+        """
+        The open SMTP connection, connecting, securing and logging in if needed
+
+        Raises:
+            _ConnectFailed: Any of those steps failed (the half-open connection is closed)
+        """
+        if self._smtp is not None:
+            return self._smtp
+        smtp = None
+        try:
+            if settings.SMTP_USE_SSL:
+                smtp = smtplib.SMTP_SSL(
+                    settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.SMTP_TIMEOUT,
+                    context=ssl.create_default_context()
+                )
+            else:
+                smtp = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.SMTP_TIMEOUT)
+                if settings.SMTP_STARTTLS:
+                    smtp.starttls(context=ssl.create_default_context())
+            if settings.SMTP_USERNAME:
+                smtp.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
+        except (smtplib.SMTPException, OSError) as e:
+            if smtp is not None:
+                smtp.close()
+            raise _ConnectFailed(f"{type(e).__name__}: {e}") from e
+        self._connect_failures = 0
+        self._smtp = smtp
+        self._smtp_used_at = time.monotonic()
+        self.connections += 1
+        return smtp
+
+    def _close_idle_smtp(self):
+        if self._smtp is not None and time.monotonic() - self._smtp_used_at > settings.SMTP_IDLE_TIMEOUT:
+            self._close_smtp()
+
+    def _close_smtp(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def pending_counts(self) -> Dict[str, int]:
+        """Outbox rows per status (reads the table)"""
+        db = SessionLocal()
+        try:
+            rows = db.execute(select(EmailOutbox.status, func.count()).group_by(EmailOutbox.status)).all()
+            return {status: count for status, count in rows}
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "smtp_connected": self._smtp is not None,
+            "smtp_connections": self.connections,
+            "batches": self.batches,
+            "sent": self.sent,
+            "retried": self.retried,
+            "deferred": self.deferred,
+            "failed": self.failed,
+            "last_error": self.last_error,
+        }
+
+# Global outbox dispatcher
+outbox_dispatcher = OutboxDispatcher()
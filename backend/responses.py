@@ -0,0 +1,37 @@
+"""
+Response classes for hot endpoints
+
+ORJSONResponse is the application's default response class: orjson encodes
+several times faster than json.dumps and handles UUID and datetime natively.
+
+Constant payloads (/, /health, the subscribe acknowledgement) go further with
+PrecomputedJSON: the body and headers are built once at import time and every
+request gets a fresh Response sharing those bytes, skipping the response_model
+validation and encoding FastAPI otherwise runs per request.
+"""
+from typing import Any, Iterable, Tuple
+
+from fastapi.responses import ORJSONResponse
+from starlette.responses import Response
+
+class _PrerenderedResponse(Response):
+    """Response around an already encoded body and header list"""
+
+    def __init__(self, status_code: int, body: bytes, raw_headers: Iterable[Tuple[bytes, bytes]]):
+        self.status_code = status_code
+        self.body = body
+        self.background = None
+        self.raw_headers = list(raw_headers)  # copied: middlewares and handlers may add headers
+
+class PrecomputedJSON:
+    """JSON payload serialized once, served as a new lightweight Response on each call"""
+
+    def __init__(self, content: Any, status_code: int = 200):
+        template = ORJSONResponse(content, status_code=status_code)
+        self.content = content
+        self.status_code = status_code
+        self.body = template.body
+        self.raw_headers = tuple(template.raw_headers)
+
+    def __call__(self) -> Response:
+        return _PrerenderedResponse(self.status_code, self.body, self.raw_headers)
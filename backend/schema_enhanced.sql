@@ -21,6 +21,9 @@ CREATE TABLE IF NOT EXISTS subscribers (
     -- Optional: Add source tracking
     source VARCHAR(50) DEFAULT 'website',
     
+    -- Double opt-in: set when the confirmation link is used
+    confirmed_at TIMESTAMP WITH TIME ZONE,
+    
     -- Add constraints
     CONSTRAINT email_format_check CHECK (
         email ~* '^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$'
@@ -36,9 +39,43 @@ CREATE TABLE IF NOT EXISTS subscribers (
 
 -- Create indexes for performance
 CREATE INDEX IF NOT EXISTS idx_subscribers_email ON subscribers(email);
-CREATE INDEX IF NOT EXISTS idx_subscribers_created_at ON subscribers(created_at DESC);
+-- (created_at, id) also serves keyset pagination for exports
+CREATE INDEX IF NOT EXISTS idx_subscribers_created_at_id ON subscribers(created_at, id);
 CREATE INDEX IF NOT EXISTS idx_subscribers_source ON subscribers(source);
 
+-- Suppression list (unsubscribed emails), primary key gives an indexed lookup
+CREATE TABLE IF NOT EXISTS suppressions (
+    email VARCHAR(254) PRIMARY KEY,
+    unsubscribed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_suppressions_unsubscribed_at ON suppressions(unsubscribed_at);
+
+-- Hourly signup/unsubscribe rollups per source, refreshed incrementally by analytics.py
+CREATE TABLE IF NOT EXISTS subscriber_rollups (
+    bucket TIMESTAMP NOT NULL,
+    source VARCHAR(50) NOT NULL,
+    signups INTEGER NOT NULL DEFAULT 0,
+    unsubscribes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, source)
+);
+
+-- Outgoing email (double opt-in confirmations), drained by outbox.py
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    recipient VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    created_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    sent_at TIMESTAMP,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_recipient ON email_outbox(recipient);
+
 -- Create function to automatically lowercase emails
 CREATE OR REPLACE FUNCTION lowercase_email()
 RETURNS TRIGGER AS $$
@@ -56,6 +93,8 @@ CREATE TRIGGER trigger_lowercase_email
     EXECUTE FUNCTION lowercase_email();
 
 -- Add some useful views for analytics (optional)
+-- Aggregates the whole table on every query; dashboards should use
+-- subscriber_rollups (GET /api/admin/analytics) instead
 CREATE OR REPLACE VIEW subscriber_stats AS
 SELECT 
     COUNT(*) as total_subscribers,
@@ -80,3 +119,5 @@ COMMENT ON COLUMN subscribers.email IS 'Email address, automatically converted t
 COMMENT ON COLUMN subscribers.created_at IS 'Timestamp when the subscriber was created';
 COMMENT ON COLUMN subscribers.ip_hash IS 'Hashed IP address for security tracking (optional)';
 COMMENT ON COLUMN subscribers.source IS 'Source of the subscription (website, api, etc.)';
+COMMENT ON TABLE suppressions IS 'Email addresses that unsubscribed and must not be contacted';
+COMMENT ON TABLE subscriber_rollups IS 'Hourly signups and unsubscribes per source (UTC buckets)';
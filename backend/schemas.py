@@ -1,42 +1,33 @@
-from pydantic import BaseModel, EmailStr, Field, validator
+from pydantic import BaseModel, Field, validator
 from datetime import datetime
 from typing import Optional
 import uuid
-import re
+
+from email_validation import validate_email
+from metrics import subscribe_stage_duration
 
 class SubscriberCreate(BaseModel):
     """Schema for creating a new subscriber with enhanced validation"""
-    email: EmailStr = Field(
+    email: str = Field(
         ...,
         description="Valid email address",
         min_length=5,
         max_length=254,  # RFC 5321 limit
         example="user@example.com"
     )
+    source: str = Field(
+        "website",
+        description="Signup source, for analytics",
+        max_length=50,
+        pattern=r"^[a-z0-9_-]+$",
+        example="website"
+    )
     
     @validator('email')
     def validate_email_security(cls, v):
-        """Additional email validation for security"""
-        email_str = str(v).lower().strip()
-        
-        # Block suspicious domains/patterns
-        blocked_patterns = [
-            r'\.temp\.',
-            r'\.disposable\.',
-            r'10minute',
-            r'mailinator',
-            r'guerrillamail',
-        ]
-        
-        for pattern in blocked_patterns:
-            if re.search(pattern, email_str, re.IGNORECASE):
-                raise ValueError('Email domain not allowed')
-        
-        # Ensure email is properly formatted
-        if '..' in email_str or email_str.startswith('.') or email_str.endswith('.'):
-            raise ValueError('Invalid email format')
-            
-        return email_str
+        """Email format and disposable-domain validation (shared rule set)"""
+        with subscribe_stage_duration.time("email_validation"):
+            return validate_email(v)
 
 class SubscriberResponse(BaseModel):
     """Schema for subscriber response"""
@@ -58,7 +49,7 @@ class ErrorResponse(BaseModel):
 
 class UnsubscribeRequest(BaseModel):
     """Schema for unsubscribe request"""
-    email: EmailStr = Field(
+    email: str = Field(
         ...,
         description="Email address to unsubscribe",
         min_length=5,
@@ -68,16 +59,15 @@ class UnsubscribeRequest(BaseModel):
     
     @validator('email')
     def validate_email_format(cls, v):
-        """Validate email format for unsubscribe"""
-        email_str = str(v).lower().strip()
-        
-        # Basic security validation
-        if '..' in email_str or email_str.startswith('.') or email_str.endswith('.'):
-            raise ValueError('Invalid email format')
-            
-        return email_str
+        """Validate email format for unsubscribe (any domain may unsubscribe)"""
+        return validate_email(v, check_domain=False)
 
 class UnsubscribeResponse(BaseModel):
     """Schema for unsubscribe response"""
     message: str
     email: str
+
+class ConfirmResponse(BaseModel):
+    """Schema for subscription confirmation response"""
+    message: str
+    email: str
@@ -0,0 +1,164 @@
+"""
+Production server entry point
+
+    python serve.py
+
+Runs gunicorn as the process manager with uvicorn workers. Every knob comes
+from config.Settings (SERVER_* variables), so throughput is scaled by
+changing the container's CPU limit or the environment, not the code:
+
+- workers: SERVER_WORKERS, or available CPUs x SERVER_WORKERS_PER_CPU capped
+  at SERVER_MAX_WORKERS. Available CPUs honour the cgroup CPU quota, so a
+  container limited to 0.5 CPU on a 16-core host counts as 0.5, not 16. More
+  than one worker per CPU pays off here because request handlers spend most
+  of their time waiting on the database. Each worker has its own connection
+  pool (DB_POOL_SIZE + DB_MAX_OVERFLOW), which must fit the server's
+  max_connections.
+- event loop and HTTP parser: uvloop and httptools when installed
+  (SERVER_LOOP/SERVER_HTTP = "auto").
+- SERVER_KEEPALIVE and SERVER_BACKLOG.
+- worker recycling after SERVER_MAX_REQUESTS (+ random jitter) requests,
+  which gunicorn replaces with a fresh process. Plain uvicorn --workers does
+  not restart exited workers.
+- graceful shutdown: on SIGTERM each worker stops accepting connections,
+  finishes in-flight requests, then runs the app's shutdown hooks (which
+  drain the write-behind queue) before SERVER_GRACEFUL_TIMEOUT runs out.
+- metrics: with more than one worker, workers share METRICS_MULTIPROC_DIR
+  (a temporary directory unless set) so /metrics reports every worker, and
+  the master archives the counters of exited workers (see metrics.py).
+
+Use ``python main.py`` for local development (single process, auto-reload).
+"""
+import importlib.util
+import logging
+import math
+import os
+import tempfile
+from typing import Dict, Optional
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+from config import settings
+from metrics import archive_worker_snapshot, prepare_multiproc_dir
+
+logger = logging.getLogger("gunicorn.error")
+
+# Reserved for the app's shutdown hooks after in-flight requests are done:
+# write-behind drain (10 s), the outbox batch being sent (5 s) plus log flush
+SHUTDOWN_HOOKS_BUDGET = 17
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """CPU limit from the cgroup (v2, then v1), None when unlimited or unknown"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+def available_cpus() -> float:
+    """CPUs this process may use: affinity mask, further limited by the cgroup quota"""
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except AttributeError:  # not available on macOS
+        cpus = float(os.cpu_count() or 1)
+    quota = _cgroup_cpu_quota()
+    return min(cpus, quota) if quota else cpus
+
+def worker_count() -> int:
+    if settings.SERVER_WORKERS > 0:
+        return settings.SERVER_WORKERS
+    workers = math.ceil(available_cpus() * settings.SERVER_WORKERS_PER_CPU)
+    # With recycling on, keep a second worker serving while one restarts
+    minimum = 2 if settings.SERVER_MAX_REQUESTS else 1
+    return max(minimum, min(workers, settings.SERVER_MAX_WORKERS))
+
+def _resolve(option: str, module: str) -> str:
+    """Report what "auto" resolves to, for the startup log"""
+    if option != "auto":
+        return option
+    return module if importlib.util.find_spec(module) else "default"
+
+class NutriFlowWorker(UvicornWorker):
+    """Uvicorn worker with the event loop, HTTP parser and drain timeout from settings"""
+
+    CONFIG_KWARGS = {
+        "loop": settings.SERVER_LOOP,
+        "http": settings.SERVER_HTTP,
+        # Stop waiting for open connections early enough for the shutdown hooks to run
+        "timeout_graceful_shutdown": max(1, settings.SERVER_GRACEFUL_TIMEOUT - SHUTDOWN_HOOKS_BUDGET),
+        "server_header": False,
+    }
+
+class Server(BaseApplication):
+    """gunicorn application configured from settings instead of a config file"""
+
+    def __init__(self, options: Dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Workers import the app themselves (no preload): nothing, in
+        # particular no database connection, is shared across the fork
+        from main import app
+        return app
+
+def server_options() -> Dict:
+    return {
+        "bind": f"{settings.SERVER_HOST}:{settings.SERVER_PORT}",
+        "workers": worker_count(),
+        "worker_class": "serve.NutriFlowWorker",
+        "keepalive": settings.SERVER_KEEPALIVE,
+        "backlog": settings.SERVER_BACKLOG,
+        "max_requests": settings.SERVER_MAX_REQUESTS,
+        "max_requests_jitter": settings.SERVER_MAX_REQUESTS_JITTER if settings.SERVER_MAX_REQUESTS else 0,
+        "graceful_timeout": settings.SERVER_GRACEFUL_TIMEOUT,
+        "timeout": settings.SERVER_TIMEOUT,
+        "accesslog": "-" if settings.DEBUG else None,
+        "loglevel": "info",
+        "preload_app": False,
+    }
+
+def _archive_worker_metrics(server, worker):
+    """gunicorn child_exit hook: keep the counters of a worker that exited"""
+    try:
+        archive_worker_snapshot(settings.METRICS_MULTIPROC_DIR, worker.pid)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not archive metrics of worker %d: %s", worker.pid, e)
+
+def _setup_metrics(options: Dict):
+    """Share metrics between workers through a directory (workers inherit settings at fork)"""
+    if not settings.METRICS_ENABLED or (options["workers"] < 2 and not settings.METRICS_MULTIPROC_DIR):
+        return
+    if not settings.METRICS_MULTIPROC_DIR:
+        settings.METRICS_MULTIPROC_DIR = tempfile.mkdtemp(prefix="nutriflow-metrics-")
+    prepare_multiproc_dir(settings.METRICS_MULTIPROC_DIR)
+    options["child_exit"] = _archive_worker_metrics
+
+def main():
+    options = server_options()
+    _setup_metrics(options)
+    logger.info(
+        "Starting %d workers on %s (%.2f CPUs available, loop %s, http %s, max requests %d)",
+        options["workers"], options["bind"], available_cpus(),
+        _resolve(settings.SERVER_LOOP, "uvloop"), _resolve(settings.SERVER_HTTP, "httptools"),
+        options["max_requests"]
+    )
+    Server(options).run()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
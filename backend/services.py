@@ -1,43 +1,182 @@
+from sqlalchemy import select, func, literal_column, exists, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
-from database import Subscriber
+from database import Subscriber, Suppression
+from membership import membership_filter
+from counting import subscriber_counter
 from schemas import SubscriberCreate
+from config import settings
+from confirmation import confirmation_outbox_insert, confirmation_resend_insert, initial_confirmed_at
+from typing import List, Optional, Tuple
+from datetime import datetime
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 
+def _dialect_insert(dialect_name: str, model):
+    """INSERT construct for the current dialect, with ON CONFLICT support"""
+    return pg_insert(model) if dialect_name == "postgresql" else sqlite_insert(model)
+
+def _upsert_statement(dialect_name: str, email: str, source: str = "website"):
+    """
+    Build a single INSERT ... ON CONFLICT (email) ... RETURNING statement
+    
+    On PostgreSQL the conflicting row is touched with a no-op DO UPDATE so it is
+    always returned, and ``xmax = 0`` tells a fresh insert from an existing row.
+    Other dialects use DO NOTHING and return no row on conflict.
+    """
+    columns = (Subscriber.id, Subscriber.email, Subscriber.created_at, Subscriber.confirmed_at)
+    values = {"email": email, "source": source, "confirmed_at": initial_confirmed_at()}
+    if dialect_name == "postgresql":
+        stmt = _dialect_insert(dialect_name, Subscriber).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Subscriber.email],
+            set_={"email": stmt.excluded.email}
+        )
+        return stmt.returning(*columns, literal_column("(xmax = 0)").label("inserted"))
+    
+    stmt = _dialect_insert(dialect_name, Subscriber).values(**values)
+    return stmt.on_conflict_do_nothing(index_elements=[Subscriber.email]).returning(*columns)
+
+def _upsert_result(row, created: Optional[bool] = None) -> Tuple[Subscriber, bool]:
+    """Turn a RETURNING (or _existing_subscriber_query) row into a (subscriber, created) pair"""
+    subscriber = Subscriber(id=row.id, email=row.email, created_at=row.created_at, confirmed_at=row.confirmed_at)
+    if created is None:
+        created = bool(row.inserted) if "inserted" in row._fields else True
+    return subscriber, created
+
+def _existing_subscriber_query(email: str):
+    """The conflicting row, for dialects whose DO NOTHING returns none"""
+    return select(Subscriber.id, Subscriber.email, Subscriber.created_at, Subscriber.confirmed_at).where(
+        Subscriber.email == email
+    )
+
+def _confirmation_statement(subscriber: Optional[Subscriber], created: bool):
+    """
+    Confirmation email to queue with an upsert, or None
+    
+    New subscribers get one in the same transaction (the email exists if and
+    only if the subscriber does). A pending subscriber submitting the form
+    again gets a new link, throttled by confirmation_resend_insert, since
+    the first one may have expired or been lost.
+    """
+    if not settings.DOUBLE_OPT_IN_ENABLED or subscriber is None:
+        return None
+    if created:
+        return confirmation_outbox_insert([subscriber.email])
+    if subscriber.confirmed_at is None:
+        return confirmation_resend_insert(subscriber.email)
+    return None
+
+def _bulk_insert_statement(dialect_name: str, entries: List[Tuple[str, str]], confirmed: Optional[bool] = None):
+    """
+    One multi-row INSERT of (email, source) pairs, ON CONFLICT DO NOTHING, returning the emails inserted
+    
+    confirmed=True stores the rows as already confirmed (imports); None
+    follows DOUBLE_OPT_IN_ENABLED.
+    """
+    now = datetime.utcnow()
+    confirmed_at = initial_confirmed_at(confirmed)
+    rows = [
+        {"id": uuid.uuid4(), "email": email, "source": source, "created_at": now, "confirmed_at": confirmed_at}
+        for email, source in entries
+    ]
+    stmt = _dialect_insert(dialect_name, Subscriber).values(rows)
+    return stmt.on_conflict_do_nothing(index_elements=[Subscriber.email]).returning(Subscriber.email)
+
+def _suppression_statement(dialect_name: str, email: str):
+    """Idempotent INSERT of an email into the suppressions table"""
+    stmt = _dialect_insert(dialect_name, Suppression).values(email=email)
+    return stmt.on_conflict_do_nothing(index_elements=[Suppression.email])
+
+def _confirm_statement(email: str):
+    """Set confirmed_at once; a second confirmation matches no row"""
+    return (
+        update(Subscriber)
+        .where(Subscriber.email == email, Subscriber.confirmed_at.is_(None))
+        .values(confirmed_at=datetime.utcnow())
+    )
+
+def _suppression_lookup(email: str):
+    """Indexed membership check against the suppressions table"""
+    return select(Suppression.email).where(Suppression.email == email).limit(1)
+
+# reltuples is -1 (PostgreSQL 14+) or 0 until the table is first vacuumed/analyzed
+_ESTIMATE_QUERY = text("SELECT reltuples FROM pg_class WHERE oid = 'subscribers'::regclass")
+
+def _keyset_page_query(
+    after: Optional[Tuple[datetime, uuid.UUID]],
+    limit: int,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    exclude_suppressed: bool = True,
+    confirmed_only: bool = True
+):
+    """
+    Next page of subscribers in (created_at, id) order, starting after a key
+    
+    Seeks through idx_subscribers_created_at_id, so each page costs the same
+    whatever its depth, unlike OFFSET. Subscribers who have not used their
+    double opt-in link are left out unless confirmed_only is False.
+    """
+    stmt = select(Subscriber.id, Subscriber.email, Subscriber.created_at)
+    if after is not None:
+        stmt = stmt.where(tuple_(Subscriber.created_at, Subscriber.id) > tuple_(*after))
+    if created_from is not None:
+        stmt = stmt.where(Subscriber.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(Subscriber.created_at < created_to)
+    if exclude_suppressed:
+        stmt = stmt.where(~exists().where(Suppression.email == Subscriber.email))
+    if confirmed_only:
+        stmt = stmt.where(Subscriber.confirmed_at.isnot(None))
+    return stmt.order_by(Subscriber.created_at, Subscriber.id).limit(limit)
+
 class SubscriberService:
     """Service for managing subscribers"""
     
     @staticmethod
-    def create_subscriber(db: Session, subscriber_data: SubscriberCreate) -> Subscriber:
+    def upsert_subscriber(db: Session, subscriber_data: SubscriberCreate) -> Tuple[Subscriber, bool]:
         """
-        Create a new subscriber
+        Insert a subscriber or return the existing one in a single statement
         
         Args:
             db: Database session
             subscriber_data: Subscriber creation data
             
         Returns:
-            Created subscriber
+            Tuple of (subscriber, created) where created is False for an existing email
             
         Raises:
-            IntegrityError: If email already exists
+            IntegrityError: If the row violates a constraint other than the email
+                uniqueness (e.g. the email format CHECK of schema.sql)
         """
+        stmt = _upsert_statement(db.get_bind().dialect.name, subscriber_data.email, subscriber_data.source)
         try:
-            # Create new subscriber
-            db_subscriber = Subscriber(email=subscriber_data.email)
-            db.add(db_subscriber)
+            row = db.execute(stmt).first()
+            if row is not None:
+                subscriber, created = _upsert_result(row)
+            else:
+                # Conflict on a dialect without DO UPDATE ... RETURNING support for it
+                existing = db.execute(_existing_subscriber_query(subscriber_data.email)).first()
+                subscriber, created = _upsert_result(existing, created=False) if existing else (None, False)
+            confirmation = _confirmation_statement(subscriber, created)
+            if confirmation is not None:
+                db.execute(confirmation)
             db.commit()
-            db.refresh(db_subscriber)
-            
-            logger.info(f"New subscriber created: {subscriber_data.email}")
-            return db_subscriber
-            
-        except IntegrityError as e:
+        except IntegrityError:
             db.rollback()
-            logger.warning(f"Attempted to create duplicate subscriber: {subscriber_data.email}")
-            raise e
+            logger.warning("Subscriber rejected by a database constraint: %s", subscriber_data.email)
+            raise
+        
+        if created:
+            subscriber_counter.add()
+            logger.info("New subscriber created: %s", subscriber_data.email)
+        return subscriber, created
     
     @staticmethod
     def get_subscriber_by_email(db: Session, email: str) -> Subscriber:
@@ -68,6 +207,29 @@ class SubscriberService:
         """
         return db.query(Subscriber).offset(skip).limit(limit).all()
     
+    @staticmethod
+    def get_subscribers_page(
+        db: Session,
+        after: Optional[Tuple[datetime, uuid.UUID]] = None,
+        limit: int = 1000,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None
+    ):
+        """
+        Keyset-paginated subscribers, excluding suppressed addresses
+        
+        Args:
+            db: Database session
+            after: (created_at, id) of the last row of the previous page, None for the first page
+            limit: Maximum number of rows to return
+            created_from: Only subscribers created at or after this time
+            created_to: Only subscribers created before this time
+            
+        Returns:
+            List of (id, email, created_at) rows in (created_at, id) order
+        """
+        return db.execute(_keyset_page_query(after, limit, created_from, created_to)).all()
+    
     @staticmethod
     def get_subscriber_count(db: Session) -> int:
         """
@@ -79,19 +241,29 @@ class SubscriberService:
         Returns:
             Total subscriber count
         """
-        return db.query(Subscriber).count()
+        # Plain COUNT(*); Query.count() wraps the query in a subquery
+        return db.execute(select(func.count()).select_from(Subscriber)).scalar_one()
+    
+    @staticmethod
+    def get_estimated_subscriber_count(db: Session) -> Optional[int]:
+        """
+        Planner estimate of the subscriber count (PostgreSQL pg_class.reltuples)
+        
+        Args:
+            db: Database session
+            
+        Returns:
+            Estimated row count, or None on other databases or before the table was analyzed
+        """
+        if db.get_bind().dialect.name != "postgresql":
+            return None
+        estimate = db.execute(_ESTIMATE_QUERY).scalar()
+        return int(estimate) if estimate is not None and estimate >= 0 else None
 
     @staticmethod
     def unsubscribe_email(db: Session, email: str) -> bool:
         """
-        Unsubscribe an email address by marking it in unsubscribed list
-        
-        For production use, this could:
-        1. Add to unsubscribed_emails table
-        2. Mark subscriber as inactive
-        3. Store in external service like SendGrid suppressions
-        
-        For this demo, we'll store in a simple JSON file
+        Unsubscribe an email address by adding it to the suppressions table
         
         Args:
             db: Database session
@@ -100,72 +272,257 @@ class SubscriberService:
         Returns:
             True if successfully unsubscribed, False if email not found
         """
-        import json
-        import os
-        from pathlib import Path
-        
         try:
-            # Check if subscriber exists
+            # Authoritative check: the membership filter may lag other workers' writes
             subscriber = db.query(Subscriber).filter(Subscriber.email == email).first()
             if not subscriber:
-                logger.warning(f"Unsubscribe attempt for non-existent email: {email}")
+                logger.warning("Unsubscribe attempt for non-existent email: %s", email)
                 return False
             
-            # Path to unsubscribed emails file
-            unsubscribed_file = Path("unsubscribed_emails.json")
-            
-            # Load existing unsubscribed emails
-            unsubscribed_emails = []
-            if unsubscribed_file.exists():
-                try:
-                    with open(unsubscribed_file, 'r') as f:
-                        unsubscribed_emails = json.load(f)
-                except json.JSONDecodeError:
-                    logger.warning("Invalid JSON in unsubscribed_emails.json, starting fresh")
-                    unsubscribed_emails = []
-            
-            # Add email to unsubscribed list if not already there
-            if email not in unsubscribed_emails:
-                unsubscribed_emails.append(email)
-                
-                # Save updated list
-                with open(unsubscribed_file, 'w') as f:
-                    json.dump(unsubscribed_emails, f, indent=2)
-                
-                logger.info(f"Email unsubscribed successfully: {email}")
-            else:
-                logger.info(f"Email already unsubscribed: {email}")
+            dialect_name = db.get_bind().dialect.name
+            result = db.execute(_suppression_statement(dialect_name, email))
+            db.commit()
+            membership_filter.add_suppression(email)
             
+            if result.rowcount:
+                logger.info("Email unsubscribed successfully: %s", email)
+            else:
+                logger.info("Email already unsubscribed: %s", email)
             return True
             
         except Exception as e:
-            logger.error(f"Error unsubscribing email {email}: {str(e)}")
+            db.rollback()
+            logger.error("Error unsubscribing email %s: %s", email, e)
             return False
     
     @staticmethod
-    def is_email_unsubscribed(email: str) -> bool:
+    def confirm_subscriber(db: Session, email: str) -> bool:
         """
-        Check if an email is in the unsubscribed list
+        Mark a subscriber as confirmed (double opt-in)
         
         Args:
+            db: Database session
+            email: Email address from a verified confirmation token
+            
+        Returns:
+            True if the subscriber exists (newly or already confirmed), False otherwise
+        """
+        result = db.execute(_confirm_statement(email))
+        db.commit()
+        if result.rowcount:
+            logger.info("Subscription confirmed: %s", email)
+            return True
+        return db.execute(select(exists().where(Subscriber.email == email))).scalar()
+    
+    @staticmethod
+    def is_email_unsubscribed(db: Session, email: str) -> bool:
+        """
+        Check if an email is in the suppressions table (primary key lookup)
+        
+        Args:
+            db: Database session
             email: Email address to check
             
         Returns:
             True if email is unsubscribed, False otherwise
         """
-        import json
-        from pathlib import Path
+        if not membership_filter.might_be_suppressed(email):
+            return False
+        return db.execute(_suppression_lookup(email)).first() is not None
+
+
+class AsyncSubscriberService:
+    """Async counterpart of SubscriberService for AsyncSession (DATABASE_ASYNC mode)"""
+    
+    @staticmethod
+    async def upsert_subscriber(db: AsyncSession, subscriber_data: SubscriberCreate) -> Tuple[Subscriber, bool]:
+        """
+        Insert a subscriber or return the existing one in a single statement
         
+        Args:
+            db: Async database session
+            subscriber_data: Subscriber creation data
+            
+        Returns:
+            Tuple of (subscriber, created) where created is False for an existing email
+            
+        Raises:
+            IntegrityError: If the row violates a constraint other than the email
+                uniqueness (e.g. the email format CHECK of schema.sql)
+        """
+        stmt = _upsert_statement(db.get_bind().dialect.name, subscriber_data.email, subscriber_data.source)
         try:
-            unsubscribed_file = Path("unsubscribed_emails.json")
+            row = (await db.execute(stmt)).first()
+            if row is not None:
+                subscriber, created = _upsert_result(row)
+            else:
+                existing = (await db.execute(_existing_subscriber_query(subscriber_data.email))).first()
+                subscriber, created = _upsert_result(existing, created=False) if existing else (None, False)
+            confirmation = _confirmation_statement(subscriber, created)
+            if confirmation is not None:
+                await db.execute(confirmation)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            logger.warning("Subscriber rejected by a database constraint: %s", subscriber_data.email)
+            raise
+        
+        if created:
+            subscriber_counter.add()
+            logger.info("New subscriber created: %s", subscriber_data.email)
+        return subscriber, created
+    
+    @staticmethod
+    async def get_subscriber_by_email(db: AsyncSession, email: str) -> Subscriber:
+        """
+        Get subscriber by email
+        
+        Args:
+            db: Async database session
+            email: Email address
+            
+        Returns:
+            Subscriber if found, None otherwise
+        """
+        result = await db.execute(select(Subscriber).where(Subscriber.email == email).limit(1))
+        return result.scalars().first()
+    
+    @staticmethod
+    async def get_all_subscribers(db: AsyncSession, skip: int = 0, limit: int = 100):
+        """
+        Get all subscribers with pagination
+        
+        Args:
+            db: Async database session
+            skip: Number of records to skip
+            limit: Maximum number of records to return
             
-            if not unsubscribed_file.exists():
+        Returns:
+            List of subscribers
+        """
+        result = await db.execute(select(Subscriber).offset(skip).limit(limit))
+        return result.scalars().all()
+    
+    @staticmethod
+    async def get_subscribers_page(
+        db: AsyncSession,
+        after: Optional[Tuple[datetime, uuid.UUID]] = None,
+        limit: int = 1000,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None
+    ):
+        """
+        Keyset-paginated subscribers, excluding suppressed addresses
+        
+        Args:
+            db: Async database session
+            after: (created_at, id) of the last row of the previous page, None for the first page
+            limit: Maximum number of rows to return
+            created_from: Only subscribers created at or after this time
+            created_to: Only subscribers created before this time
+            
+        Returns:
+            List of (id, email, created_at) rows in (created_at, id) order
+        """
+        result = await db.execute(_keyset_page_query(after, limit, created_from, created_to))
+        return result.all()
+    
+    @staticmethod
+    async def get_subscriber_count(db: AsyncSession) -> int:
+        """
+        Get total number of subscribers
+        
+        Args:
+            db: Async database session
+            
+        Returns:
+            Total subscriber count
+        """
+        result = await db.execute(select(func.count()).select_from(Subscriber))
+        return result.scalar_one()
+    
+    @staticmethod
+    async def get_estimated_subscriber_count(db: AsyncSession) -> Optional[int]:
+        """
+        Planner estimate of the subscriber count (PostgreSQL pg_class.reltuples)
+        
+        Args:
+            db: Async database session
+            
+        Returns:
+            Estimated row count, or None on other databases or before the table was analyzed
+        """
+        if db.get_bind().dialect.name != "postgresql":
+            return None
+        estimate = (await db.execute(_ESTIMATE_QUERY)).scalar()
+        return int(estimate) if estimate is not None and estimate >= 0 else None
+    
+    @staticmethod
+    async def unsubscribe_email(db: AsyncSession, email: str) -> bool:
+        """
+        Unsubscribe an email address by adding it to the suppressions table
+        
+        Args:
+            db: Async database session
+            email: Email address to unsubscribe
+            
+        Returns:
+            True if successfully unsubscribed, False if email not found
+        """
+        try:
+            # Authoritative check: the membership filter may lag other workers' writes
+            result = await db.execute(select(Subscriber.id).where(Subscriber.email == email).limit(1))
+            if result.first() is None:
+                logger.warning("Unsubscribe attempt for non-existent email: %s", email)
                 return False
             
-            with open(unsubscribed_file, 'r') as f:
-                unsubscribed_emails = json.load(f)
-                return email in unsubscribed_emails
-                
+            dialect_name = db.get_bind().dialect.name
+            result = await db.execute(_suppression_statement(dialect_name, email))
+            await db.commit()
+            membership_filter.add_suppression(email)
+            
+            if result.rowcount:
+                logger.info("Email unsubscribed successfully: %s", email)
+            else:
+                logger.info("Email already unsubscribed: %s", email)
+            return True
+            
         except Exception as e:
-            logger.error(f"Error checking unsubscribed status for {email}: {str(e)}")
+            await db.rollback()
+            logger.error("Error unsubscribing email %s: %s", email, e)
+            return False
+    
+    @staticmethod
+    async def confirm_subscriber(db: AsyncSession, email: str) -> bool:
+        """
+        Mark a subscriber as confirmed (double opt-in)
+        
+        Args:
+            db: Async database session
+            email: Email address from a verified confirmation token
+            
+        Returns:
+            True if the subscriber exists (newly or already confirmed), False otherwise
+        """
+        result = await db.execute(_confirm_statement(email))
+        await db.commit()
+        if result.rowcount:
+            logger.info("Subscription confirmed: %s", email)
+            return True
+        return (await db.execute(select(exists().where(Subscriber.email == email)))).scalar()
+    
+    @staticmethod
+    async def is_email_unsubscribed(db: AsyncSession, email: str) -> bool:
+        """
+        Check if an email is in the suppressions table (primary key lookup)
+        
+        Args:
+            db: Async database session
+            email: Email address to check
+            
+        Returns:
+            True if email is unsubscribed, False otherwise
+        """
+        if not membership_filter.might_be_suppressed(email):
             return False
+        return (await db.execute(_suppression_lookup(email))).first() is not None
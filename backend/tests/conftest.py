@@ -0,0 +1,50 @@
+"""
+Shared test setup (run from the backend directory: ``python -m pytest``)
+
+Settings are read from the environment when config is imported, so the
+test configuration is set here, before any application module is loaded:
+a throwaway SQLite database, double opt-in on with a local SMTP server
+(started per test on a free port, see test_outbox.py) and a rate limit
+high enough not to get in the way.
+"""
+import os
+import tempfile
+
+_DATABASE_DIR = tempfile.mkdtemp(prefix="nutriflow-tests-")
+
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_DATABASE_DIR}/test.db",
+    DATABASE_ASYNC="False",
+    SECRET_KEY="test-secret-key-" + "x" * 48,
+    SMTP_HOST="127.0.0.1",
+    SMTP_STARTTLS="False",
+    SMTP_USERNAME="",
+    DOUBLE_OPT_IN_ENABLED="True",
+    WRITE_BEHIND_ENABLED="False",
+    COALESCE_ENABLED="False",
+    RATE_LIMIT_BACKEND="memory",
+    RATE_LIMIT_REQUESTS="1000",
+    METRICS_MULTIPROC_DIR="",
+    LOG_ASYNC="False",
+)
+
+import pytest
+from sqlalchemy import delete
+
+from database import EmailOutbox, SessionLocal, Subscriber, ensure_schema
+
+@pytest.fixture(scope="session")
+def schema():
+    ensure_schema()
+
+@pytest.fixture
+def db(schema):
+    """Session on empty subscribers and email_outbox tables"""
+    session = SessionLocal()
+    session.execute(delete(EmailOutbox))
+    session.execute(delete(Subscriber))
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,146 @@
+"""Double opt-in: outbox rows, dispatch over SMTP (aiosmtpd) and /api/confirm"""
+import asyncio
+import socket
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+import services
+from config import settings
+from confirmation import confirmation_outbox_insert, make_confirmation_token
+from database import EmailOutbox, Subscriber
+from outbox import OutboxDispatcher
+from schemas import SubscriberCreate
+from services import SubscriberService
+
+class RecordingHandler:
+    """Accepts mail except for recipients starting with busy (450) or gone (550)"""
+
+    def __init__(self):
+        self.messages = []  # (client port, recipient)
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("busy"):
+            return "450 4.2.1 Mailbox busy, try again later"
+        if address.startswith("gone"):
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        for recipient in envelope.rcpt_tos:
+            self.messages.append((session.peer[1], recipient))
+        return "250 Message accepted"
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    monkeypatch.setattr(settings, "SMTP_PORT", controller.port)
+    try:
+        yield handler
+    finally:
+        controller.stop()
+
+@pytest.fixture
+def dispatcher():
+    outbox = OutboxDispatcher()
+    try:
+        yield outbox
+    finally:
+        outbox._close_smtp()
+
+def _queue(db, *recipients):
+    db.execute(confirmation_outbox_insert(recipients))
+    db.commit()
+
+def _outbox(db):
+    return {row.recipient: row for row in db.execute(select(EmailOutbox)).scalars()}
+
+def test_signup_enqueues_one_confirmation_in_the_same_transaction(db, monkeypatch):
+    subscriber, created = SubscriberService.upsert_subscriber(db, SubscriberCreate(email="new@gmail.com"))
+    assert created and subscriber.confirmed_at is None
+    assert [row.recipient for row in _outbox(db).values()] == ["new@gmail.com"]
+
+    # A failing outbox insert rolls the subscriber back with it
+    monkeypatch.setattr(
+        services, "confirmation_outbox_insert",
+        lambda emails: insert(EmailOutbox).values(
+            [{"kind": "confirmation", "recipient": email, "subject": "", "body": None} for email in emails]
+        )  # NOT NULL violation on body
+    )
+    with pytest.raises(IntegrityError):
+        SubscriberService.upsert_subscriber(db, SubscriberCreate(email="other@gmail.com"))
+    assert db.scalar(select(func.count()).select_from(Subscriber).where(Subscriber.email == "other@gmail.com")) == 0
+    assert list(_outbox(db)) == ["new@gmail.com"]
+
+def test_dispatcher_sends_a_batch_over_one_connection(db, smtp_server, dispatcher):
+    _queue(db, "a@gmail.com", "b@gmail.com", "c@gmail.com")
+
+    assert dispatcher.dispatch_batch() == 3
+
+    assert sorted(recipient for _, recipient in smtp_server.messages) == ["a@gmail.com", "b@gmail.com", "c@gmail.com"]
+    assert len({port for port, _ in smtp_server.messages}) == 1  # one client connection
+    assert dispatcher.connections == 1
+    db.expire_all()
+    assert {row.status for row in _outbox(db).values()} == {"sent"}
+
+def test_temporary_failure_is_retried_with_backoff_and_permanent_refusal_fails(db, smtp_server, dispatcher):
+    _queue(db, "busy@gmail.com", "gone@gmail.com", "ok@gmail.com")
+    started = datetime.utcnow()
+
+    dispatcher.dispatch_batch()
+
+    db.expire_all()
+    rows = _outbox(db)
+    busy, gone, ok = rows["busy@gmail.com"], rows["gone@gmail.com"], rows["ok@gmail.com"]
+    assert ok.status == "sent"
+    assert gone.status == "failed" and "550" in gone.last_error
+    assert busy.status == "pending" and busy.attempts == 1 and "450" in busy.last_error
+    # First retry after OUTBOX_RETRY_BASE seconds, doubled for each later attempt
+    expected = started + timedelta(seconds=settings.OUTBOX_RETRY_BASE)
+    assert expected - timedelta(seconds=2) <= busy.next_attempt_at <= expected + timedelta(seconds=5)
+    # Not due yet: the next batch leaves it alone
+    assert dispatcher.dispatch_batch() == 0
+
+def _confirm(token: str) -> httpx.Response:
+    from main import app
+
+    async def request():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+            return await client.get("/api/confirm", params={"token": token})
+    return asyncio.run(request())
+
+def test_confirm_rejects_expired_and_tampered_tokens(db):
+    SubscriberService.upsert_subscriber(db, SubscriberCreate(email="pending@gmail.com"))
+    valid = make_confirmation_token("pending@gmail.com")
+    expired = make_confirmation_token("pending@gmail.com", now=time.time() - settings.CONFIRMATION_TOKEN_TTL - 60)
+    encoded_email, expires, signature = valid.split(".")
+    other_email = make_confirmation_token("someone@gmail.com").split(".")[0]
+    tampered = [
+        f"{other_email}.{expires}.{signature}",  # email swapped
+        f"{encoded_email}.{int(expires) + 86400}.{signature}",  # expiry extended
+        f"{encoded_email}.{expires}.{signature[:-2]}AA",  # signature altered
+    ]
+
+    for token in [expired] + tampered:
+        response = _confirm(token)
+        assert response.status_code == 400, token
+    db.expire_all()
+    assert db.scalar(select(Subscriber.confirmed_at).where(Subscriber.email == "pending@gmail.com")) is None
+
+    assert _confirm(valid).status_code == 200
+    db.expire_all()
+    assert db.scalar(select(Subscriber.confirmed_at).where(Subscriber.email == "pending@gmail.com")) is not None
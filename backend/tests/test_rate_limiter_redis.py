@@ -0,0 +1,58 @@
+"""RedisRateLimiter's Lua script, run against fakeredis"""
+import asyncio
+
+import fakeredis
+import pytest
+
+from config import settings
+from security import RedisRateLimiter
+
+CLIENT = "198.51.100.7"
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_REQUESTS", 3)
+    monkeypatch.setattr(settings, "RATE_LIMIT_WINDOW", 300)
+    return RedisRateLimiter(fakeredis.FakeAsyncRedis(), prefix="test")
+
+def test_allows_up_to_the_limit_then_blocks_progressively(limiter):
+    async def run():
+        return [await limiter.hit(CLIENT) for _ in range(5)]
+
+    results = asyncio.run(run())
+    assert results[:3] == [(False, None)] * 3
+    # First block: 300 s while the client has under 50 recorded requests
+    assert results[3] == (True, 300)
+    # Still blocked, with the remaining time counting down
+    limited, remaining = results[4]
+    assert limited
+    assert 0 < remaining <= 300
+
+def test_escalates_to_a_permanent_block(limiter):
+    async def run():
+        # A client with a long history (over 1000 recorded requests) hits the limit again
+        await limiter.redis.hset(f"test:{CLIENT}:state", "total_requests", 1001)
+        for _ in range(3):
+            await limiter.hit(CLIENT)
+        blocking_hit = await limiter.hit(CLIENT)
+        await limiter.redis.hdel(f"test:{CLIENT}:state", "blocked_until")  # temporary block over
+        after = await limiter.hit(CLIENT)
+        return blocking_hit, after, await limiter.redis.sismember(limiter.blocked_key, CLIENT)
+
+    blocking_hit, after, permanently_blocked = asyncio.run(run())
+    assert blocking_hit[0]
+    assert permanently_blocked
+    assert after == (True, None)  # no retry-after for a permanent block
+
+def test_reset_clears_permanent_block_and_history(limiter):
+    async def run():
+        await limiter.redis.sadd(limiter.blocked_key, CLIENT)
+        before = await limiter.hit(CLIENT)
+        await limiter.reset(CLIENT)
+        after = [await limiter.hit(CLIENT) for _ in range(3)]
+        return before, after, await limiter.redis.exists(f"test:{CLIENT}:state")
+
+    before, after, state_exists = asyncio.run(run())
+    assert before == (True, None)
+    assert after == [(False, None)] * 3  # full allowance again
+    assert state_exists  # recreated by the new requests only
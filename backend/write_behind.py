@@ -0,0 +1,331 @@
+"""
+Write-behind queue for subscription inserts
+
+With WRITE_BEHIND_ENABLED, /api/subscribe validates the request, enqueues the
+email and its signup source and answers 202 straight away. A background task
+collects queued emails until WRITE_BEHIND_BATCH_SIZE is reached or
+WRITE_BEHIND_FLUSH_INTERVAL_MS has passed since the first one, and writes
+them with one multi-row
+INSERT ... ON CONFLICT (email) DO NOTHING, so a burst of signups shares one
+commit instead of paying one each.
+
+Failed batches are retried with backoff; batches that still fail, and
+whatever is left in the queue at shutdown, are appended to
+WRITE_BEHIND_SPILL_FILE (one "email<TAB>source" line each). The flusher
+replays that file at startup and every WRITE_BEHIND_REPLAY_INTERVAL seconds,
+so a short database outage does not strand signups until the next restart.
+All workers share the file: appends take an exclusive flock, and a replay
+claims the file by renaming it to ``<spill file>.replay.<unique suffix>``
+while holding that lock, so each line is replayed by one worker. The claimed
+file stays locked until every batch in it is written (or spilled again) and
+only then is removed: a replay interrupted by shutdown or a crash leaves it
+behind unlocked, and the next replay by any worker picks it up. Replaying an
+entry twice is harmless (ON CONFLICT DO NOTHING). In Docker the files live
+on the backend_data volume.
+"""
+import asyncio
+import fcntl
+import glob
+import logging
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from database import SessionLocal, AsyncSessionLocal
+from counting import subscriber_counter
+from metrics import registry
+from services import _bulk_insert_statement
+from confirmation import confirmation_outbox_insert
+from outbox import outbox_dispatcher
+
+logger = logging.getLogger(__name__)
+
+flush_duration = registry.histogram(
+    "nutriflow_write_behind_flush_seconds",
+    "Time to write one batch of queued subscriptions",
+)
+flushed_rows = registry.counter(
+    "nutriflow_write_behind_rows_total",
+    "Queued subscriptions written, by outcome",
+    ("outcome",),
+)
+
+class SubscriptionWriteBehind:
+    """Bounded in-process queue of validated emails flushed to the database in batches"""
+
+    def __init__(self):
+        self.enabled = settings.WRITE_BEHIND_ENABLED
+        self.batch_size = settings.WRITE_BEHIND_BATCH_SIZE
+        self.flush_interval = settings.WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000
+        self.max_queue = settings.WRITE_BEHIND_MAX_QUEUE
+        self.spill_file = settings.WRITE_BEHIND_SPILL_FILE
+        self.replay_interval = settings.WRITE_BEHIND_REPLAY_INTERVAL
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.rejected = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.spilled = 0
+        self.replayed = 0
+
+    def submit(self, email: str, source: str = "website") -> bool:
+        """
+        Queue a validated email for insertion
+
+        Returns:
+            False if the queue is not running or full; the caller should write directly
+        """
+        if self.queue is None:
+            return False
+        try:
+            self.queue.put_nowait((email, source))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def start(self):
+        """Create the queue, replay spilled emails and start the flush task"""
+        if not self.enabled or self._task is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        await self._replay_spilled()
+        self._task = asyncio.create_task(self._run(self.queue))
+
+    async def stop(self, timeout: float = 10.0):
+        """Flush everything still queued; spill what cannot be written in time"""
+        if self._task is None:
+            return
+        queue, task = self.queue, self._task
+        self.queue = None  # new submissions fall back to direct writes
+        self._task = None
+        try:
+            await asyncio.wait_for(queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Write-behind queue not drained after %ss", timeout)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        leftover = []
+        while not queue.empty():
+            leftover.append(queue.get_nowait())
+        if leftover:
+            await asyncio.to_thread(self._spill, leftover)
+
+    async def _replay_spilled(self):
+        """Write back spilled subscriptions (from any worker); failures are spilled again"""
+        for path, f in await asyncio.to_thread(self._claim_spill_files):
+            try:
+                spilled = await asyncio.to_thread(self._read_entries, f)
+                logger.warning("Replaying %d spilled subscriptions from %s", len(spilled), path)
+                for start in range(0, len(spilled), self.batch_size):
+                    batch = spilled[start:start + self.batch_size]
+                    await self._write_with_retry(batch, attempts=3)
+                    self.replayed += len(batch)
+                # Removed while still locked, so no other worker can claim it in between
+                os.remove(path)
+            finally:
+                f.close()  # releases the lock; an unfinished file is claimed by the next replay
+
+    async def _next_item(self, queue: asyncio.Queue, timeout: Optional[float]):
+        """Next queued item, or None once timeout (None = wait forever) has passed"""
+        if timeout is None:
+            return await queue.get()
+        try:
+            return await asyncio.wait_for(queue.get(), max(0.0, timeout))
+        except asyncio.TimeoutError:
+            return None
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        next_replay = loop.time() + self.replay_interval
+        while True:
+            batch = []
+            try:
+                if self.replay_interval > 0 and loop.time() >= next_replay:
+                    await self._replay_spilled()
+                    next_replay = loop.time() + self.replay_interval
+                item = await self._next_item(queue, next_replay - loop.time() if self.replay_interval > 0 else None)
+                if item is None:
+                    continue  # replay due
+                batch.append(item)
+                deadline = loop.time() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                # Take whatever else is already waiting, up to the batch size
+                while len(batch) < self.batch_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+
+                await self._write_with_retry(batch)
+            except asyncio.CancelledError:
+                # Shutdown timed out mid-batch: keep the emails for the next start
+                if batch:
+                    self._spill(batch)
+                raise
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _write_with_retry(self, entries: List[Tuple[str, str]], attempts: int = 5):
+        """Write one batch of (email, source) pairs, retrying with exponential backoff; spill it if every attempt fails"""
+        entries = list(dict(entries).items())  # duplicate emails within a batch
+        for attempt in range(attempts):
+            started = time.perf_counter()
+            try:
+                inserted = await self._write(entries)
+            except Exception as e:
+                self.failed_batches += 1
+                logger.error("Write-behind batch of %d failed (attempt %d): %s", len(entries), attempt + 1, e)
+                await asyncio.sleep(min(5.0, 0.1 * 2 ** attempt))
+                continue
+            flush_duration.observe(time.perf_counter() - started)
+            self.batches += 1
+            self.inserted += inserted
+            subscriber_counter.add(inserted)
+            self.duplicates += len(entries) - inserted
+            flushed_rows.inc("inserted", amount=inserted)
+            flushed_rows.inc("duplicate", amount=len(entries) - inserted)
+            return
+        await asyncio.to_thread(self._spill, entries)
+
+    async def _write(self, entries: List[Tuple[str, str]]) -> int:
+        if settings.DATABASE_ASYNC:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(_bulk_insert_statement(db.get_bind().dialect.name, entries))
+                inserted = result.scalars().all()
+                if inserted and settings.DOUBLE_OPT_IN_ENABLED:
+                    await db.execute(confirmation_outbox_insert(inserted))
+                await db.commit()
+        else:
+            inserted = await asyncio.to_thread(self._write_sync, entries)
+        if inserted and settings.DOUBLE_OPT_IN_ENABLED:
+            outbox_dispatcher.notify()
+        return len(inserted)
+
+    def _write_sync(self, entries: List[Tuple[str, str]]) -> List[str]:
+        """Insert the batch and queue confirmation emails for the new rows; returns the emails inserted"""
+        db = SessionLocal()
+        try:
+            result = db.execute(_bulk_insert_statement(db.get_bind().dialect.name, entries))
+            inserted = result.scalars().all()
+            if inserted and settings.DOUBLE_OPT_IN_ENABLED:
+                db.execute(confirmation_outbox_insert(inserted))
+            db.commit()
+            return inserted
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _open_spill_file(self):
+        """Open the spill file for appending under an exclusive lock"""
+        os.makedirs(os.path.dirname(self.spill_file) or ".", exist_ok=True)
+        while True:
+            f = open(self.spill_file, "a")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.spill_file).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()  # renamed by a replaying worker while we waited: open the new file
+
+    def _spill(self, entries: List[Tuple[str, str]]):
+        try:
+            with self._open_spill_file() as f:
+                f.writelines(f"{email}\t{source}\n" for email, source in entries)
+            self.spilled += len(entries)
+            flushed_rows.inc("spilled", amount=len(entries))
+            logger.error("Spilled %d unwritten subscriptions to %s", len(entries), self.spill_file)
+        except OSError as e:
+            # Last resort: keep the addresses in the log so they can be recovered
+            logger.critical("Could not spill subscriptions (%s), lost: %s", e, ",".join(email for email, _ in entries))
+
+    def _lock_existing(self, path: str, blocking: bool = True):
+        """Open path and take its exclusive lock; None if it is gone (or locked, when not blocking)"""
+        try:
+            f = open(path, "r")
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Still the file at path: not removed or renamed by another worker while we waited
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        except (BlockingIOError, FileNotFoundError):
+            pass
+        f.close()
+        return None
+
+    def _claim_spill_files(self) -> List[Tuple[str, object]]:
+        """
+        Claim the spill file and any unfinished replay files, as (path, locked file) pairs
+
+        The spill file is renamed while locked, so appenders move on to a new
+        file. Replay files are only claimed when no live replay holds their lock.
+        """
+        if not self.spill_file:
+            return []
+        claimed = []
+        f = self._lock_existing(self.spill_file)
+        if f is not None:
+            path = f"{self.spill_file}.replay.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+            os.replace(self.spill_file, path)
+            claimed.append((path, f))
+        for path in sorted(glob.glob(glob.escape(self.spill_file) + ".replay.*")):
+            if any(path == taken for taken, _ in claimed):
+                continue
+            f = self._lock_existing(path, blocking=False)
+            if f is not None:
+                logger.warning("Resuming interrupted replay of %s", path)
+                claimed.append((path, f))
+        return claimed
+
+    def _read_entries(self, f) -> List[Tuple[str, str]]:
+        """(email, source) pairs of a claimed spill file"""
+        f.seek(0)
+        return [
+            (email, source or "website")
+            for email, _, source in (line.strip().partition("\t") for line in f if line.strip())
+        ]
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue": self.max_queue,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+        }
+
+# Global write-behind queue
+write_behind = SubscriptionWriteBehind()
+
+registry.gauge(
+    "nutriflow_write_behind_queue_depth",
+    "Subscriptions waiting to be written",
+    callback=lambda: write_behind.queue.qsize() if write_behind.queue is not None else 0,
+)